@@ -1,3 +1,4 @@
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -25,8 +26,57 @@ def create_app(config_class=Config):
     app.register_blueprint(auth.bp)
     app.register_blueprint(main.bp)
     
-    # Create tables
-    with app.app_context():
+    # Create tables (production runs `flask init-db` once instead)
+    if app.config['AUTO_CREATE_TABLES']:
+        with app.app_context():
+            db.create_all()
+    
+    @app.cli.command('init-db')
+    def init_db():
+        """
+        Create the database tables (also run by init_db.py).
+        """
         db.create_all()
+        tables = db.inspect(db.engine).get_table_names()
+        print(f'Database tables created ({len(tables)}):')
+        for table in tables:
+            print(f'  - {table}')
+    
+    @app.cli.command('backfill-contacted')
+    def backfill_contacted_command():
+        """
+        Add recipients of already sent emails to the contacted index.
+        """
+        from app.utils.recipients import backfill_contacted
+        
+        added = backfill_contacted()
+        db.session.commit()
+        print(f'Added {added} contacted recipients.')
+    
+    @app.cli.command('rollup-email-logs')
+    def rollup_email_logs_command():
+        """
+        Archive the email logs of campaigns completed ARCHIVE_AFTER_DAYS ago.
+        """
+        from app.utils.archive import rollup_email_logs
+        
+        campaigns, logs = rollup_email_logs()
+        print(f'Archived {logs} email logs from {campaigns} campaigns.')
+    
+    @app.cli.command('campaign-timings')
+    @click.argument('campaign_id', type=int)
+    def campaign_timings(campaign_id):
+        """
+        Print where a campaign's time went, per stage (needs METRICS_ENABLED).
+        """
+        from app.utils.metrics import get_campaign_timings
+        
+        timings = get_campaign_timings(campaign_id)
+        if not timings:
+            print(f'No timings recorded for campaign {campaign_id}.')
+            return
+        print(f"{'stage':<16} {'count':>8} {'total s':>10} {'mean ms':>10}")
+        for stage, entry in timings.items():
+            print(f"{stage:<16} {entry['count']:>8} {entry['seconds']:>10.2f} {entry['mean_seconds'] * 1000:>10.2f}")
     
     return app
@@ -46,5 +46,5 @@ Best regards,
     schedule_type = SelectField('Schedule Type', 
                                choices=[('auto', 'Auto-send within safe limits'), ('scheduled', 'Schedule for specific time')],
                                default='auto')
-    scheduled_time = DateTimeLocalField('Scheduled Time', format='%Y-%m-%dT%H:%M', validators=[])
+    scheduled_time = DateTimeLocalField('Scheduled Time (UTC)', format='%Y-%m-%dT%H:%M', validators=[])
     submit = SubmitField('Create Campaign')
@@ -1,11 +1,15 @@
 from app import db, login_manager
 from flask_login import UserMixin
+from sqlalchemy.orm import Session, object_session
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Cached snapshot: authenticated requests (status polls included) don't
+    # read the users table
+    from app.utils.user_cache import get_user_snapshot
+    return get_user_snapshot(int(user_id))
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -27,8 +31,31 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
 
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    # Email or password changed, or the user is gone. The cached snapshot is
+    # only dropped once the change is committed: dropped now, a request in
+    # between would cache the old row again.
+    session = object_session(target)
+    session.info.setdefault('invalidated_users', set()).add(target.id)
+
+@db.event.listens_for(Session, 'after_commit')
+def invalidate_committed_users(session):
+    from app.utils.user_cache import invalidate_user
+    for user_id in session.info.pop('invalidated_users', ()):
+        invalidate_user(user_id)
+
+@db.event.listens_for(Session, 'after_rollback')
+def forget_invalidated_users(session):
+    session.info.pop('invalidated_users', None)
+
 class Campaign(db.Model):
     __tablename__ = 'campaigns'
+    __table_args__ = (
+        # Due scheduled campaigns, found by the dispatcher with a range scan
+        db.Index('ix_campaigns_status_scheduled_time', 'status', 'scheduled_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -37,13 +64,26 @@ class Campaign(db.Model):
     email_template = db.Column(db.Text, nullable=False)
     schedule_type = db.Column(db.String(50), default='auto')  # 'auto' or 'scheduled'
     scheduled_time = db.Column(db.DateTime, nullable=True)
-    status = db.Column(db.String(50), default='draft')  # draft, active, paused, completed
+    status = db.Column(db.String(50), default='draft')  # importing, draft, scheduled, active, paused, completed
+    
+    # Companies file import progress
+    rows_parsed = db.Column(db.Integer, default=0)
+    rows_inserted = db.Column(db.Integer, default=0)
+    rows_rejected = db.Column(db.Integer, default=0)
+    rows_skipped = db.Column(db.Integer, default=0)  # already contacted by an earlier campaign
+    import_error = db.Column(db.Text)
+    
+    # Set when the campaign's email logs were rolled up and archived
+    archived_at = db.Column(db.DateTime)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     companies = db.relationship('Company', backref='campaign', lazy=True, cascade='all, delete-orphan')
     email_logs = db.relationship('EmailLog', backref='campaign', lazy=True, cascade='all, delete-orphan')
+    archived_email_logs = db.relationship('ArchivedEmailLog', lazy=True, cascade='all, delete-orphan')
+    email_summaries = db.relationship('EmailLogSummary', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Campaign {self.name}>'
@@ -58,6 +98,7 @@ class Company(db.Model):
     recipient_name = db.Column(db.String(200))
     role = db.Column(db.String(200))
     designation = db.Column(db.String(200))
+    extra_fields = db.Column(db.JSON)  # extra CSV columns, used as template placeholders
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -68,12 +109,23 @@ class Company(db.Model):
 
 class EmailLog(db.Model):
     __tablename__ = 'email_logs'
+    __table_args__ = (
+        # Grouped status counts per campaign and per user
+        db.Index('ix_email_logs_campaign_status', 'campaign_id', 'status'),
+        db.Index('ix_email_logs_user_status', 'user_id', 'status'),
+        # Keyset pagination of a campaign's logs
+        db.Index('ix_email_logs_campaign_created', 'campaign_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    status = db.Column(db.String(50), default='pending')  # pending, sent, failed, paused
+    status = db.Column(db.String(50), default='pending')  # pending, sending, sent, failed, paused
+    claimed_at = db.Column(db.DateTime)  # when a worker moved it to 'sending'
+    attempts = db.Column(db.Integer, default=0)  # send attempts so far
+    next_attempt_at = db.Column(db.DateTime)  # earliest retry after a transient error
+    error_kind = db.Column(db.String(20))  # transient, quota or permanent
     error_message = db.Column(db.Text)
     sent_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -84,6 +136,72 @@ class EmailLog(db.Model):
     def __repr__(self):
         return f'<EmailLog {self.id} - {self.status}>'
 
+class ArchivedEmailLog(db.Model):
+    """
+    Email logs of finished campaigns, moved out of email_logs by the rollup
+    task so the hot table only holds campaigns still in progress.
+    """
+    __tablename__ = 'email_logs_archive'
+    __table_args__ = (
+        # Keyset pagination of an archived campaign's logs
+        db.Index('ix_email_logs_archive_campaign_created', 'campaign_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)  # same ID as in email_logs
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    status = db.Column(db.String(50))
+    attempts = db.Column(db.Integer)
+    error_kind = db.Column(db.String(20))
+    error_message = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ArchivedEmailLog {self.id} - {self.status}>'
+
+class EmailLogSummary(db.Model):
+    """
+    Email counts of an archived campaign per day and status, which the stats
+    read instead of the archived logs.
+    """
+    __tablename__ = 'email_log_summaries'
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'day', 'status', name='uq_email_log_summary'),
+        db.Index('ix_email_log_summaries_user', 'user_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)  # sent_at, or created_at for unsent emails
+    status = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<EmailLogSummary {self.campaign_id} {self.day} {self.status}>'
+
+class ContactedRecipient(db.Model):
+    """
+    Every address a user has emailed, normalized, so new campaigns can skip
+    recipients that were already contacted.
+    """
+    __tablename__ = 'contacted_recipients'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'recipient_email', name='uq_contacted_user_email'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    recipient_email = db.Column(db.String(120), nullable=False)  # stripped and lowercased
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id', ondelete='SET NULL'))
+    first_contacted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ContactedRecipient {self.recipient_email}>'
+
 class RateLimit(db.Model):
     __tablename__ = 'rate_limits'
     
@@ -1,16 +1,29 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import (
+    Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, abort,
+    send_file, stream_with_context
+)
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from app import db
-from app.models import Campaign, Company, EmailLog
+from app.models import Campaign
 from app.forms import CampaignForm
-from app.utils.file_parser import parse_companies_file
-from app.tasks import start_email_campaign
+from app.utils.file_parser import read_extra_fields
+from app.utils.events import publish_campaign_event, set_campaign_status, get_campaign_version, stream_campaign_events
+from app.utils.email_logs import get_email_log_page, serialize_log
+from app.utils.stats import campaign_email_stats, campaigns_email_stats, sum_email_stats
+from app.utils.template_engine import compile_template, TemplateError
+from app.utils.metrics import render_metrics
+from app.utils.export import iter_export_csv, export_path
+from app.tasks import start_email_campaign, ingest_campaign_file, export_campaign_xlsx
 import os
+import redis
 from datetime import datetime
 
 bp = Blueprint('main', __name__)
 
+# Statuses the email log table can be filtered by
+LOG_STATUS_FILTERS = ('sent', 'pending', 'failed')
+
 @bp.route('/')
 def index():
     if current_user.is_authenticated:
@@ -22,16 +35,18 @@ def index():
 def dashboard():
     campaigns = Campaign.query.filter_by(user_id=current_user.id).order_by(Campaign.created_at.desc()).all()
     
-    # Get statistics
+    # Get statistics (user totals are summed from the per-campaign counts)
+    campaign_stats = campaigns_email_stats(current_user.id)
+    email_stats = sum_email_stats(campaign_stats.values())
     stats = {
         'total_campaigns': len(campaigns),
         'active_campaigns': len([c for c in campaigns if c.status == 'active']),
-        'total_sent': EmailLog.query.filter_by(user_id=current_user.id, status='sent').count(),
-        'total_pending': EmailLog.query.filter_by(user_id=current_user.id, status='pending').count(),
-        'total_failed': EmailLog.query.filter_by(user_id=current_user.id, status='failed').count(),
+        'total_sent': email_stats['sent'],
+        'total_pending': email_stats['pending'],
+        'total_failed': email_stats['failed'],
     }
     
-    return render_template('dashboard.html', campaigns=campaigns, stats=stats)
+    return render_template('dashboard.html', campaigns=campaigns, stats=stats, campaign_stats=campaign_stats)
 
 @bp.route('/campaign/new', methods=['GET', 'POST'])
 @login_required
@@ -56,55 +71,35 @@ def new_campaign():
             resume_file.save(resume_path)
             campaign.resume_path = resume_path
         
-        db.session.add(campaign)
-        db.session.flush()  # Get campaign ID
+        # Save companies file for the background import
+        companies_file = form.companies_file.data
+        filename = secure_filename(f"{current_user.id}_{datetime.utcnow().timestamp()}_{companies_file.filename}")
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        companies_file.save(file_path)
         
-        # Handle companies file upload
-        if form.companies_file.data:
-            companies_file = form.companies_file.data
-            filename = secure_filename(companies_file.filename)
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            companies_file.save(file_path)
-            
-            # Parse companies
-            companies_data = parse_companies_file(file_path)
-            
-            if companies_data:
-                for company_data in companies_data:
-                    company = Company(
-                        campaign_id=campaign.id,
-                        company_name=company_data.get('company_name', ''),
-                        recipient_email=company_data.get('email', ''),
-                        recipient_name=company_data.get('name', ''),
-                        role=company_data.get('role', ''),
-                        designation=company_data.get('designation', '')
-                    )
-                    db.session.add(company)
-                    
-                    # Create email log entry
-                    email_log = EmailLog(
-                        campaign_id=campaign.id,
-                        company_id=company.id,
-                        user_id=current_user.id,
-                        status='pending'
-                    )
-                    db.session.add(email_log)
-                
-                flash(f'Campaign created with {len(companies_data)} companies!', 'success')
-            else:
-                flash('No valid companies found in the file.', 'warning')
-            
-            # Clean up uploaded file
+        # Check placeholders now rather than sending "{foo}" later
+        extra_fields = read_extra_fields(file_path)
+        if extra_fields is None:
+            os.remove(file_path)
+            flash('Could not read the companies file. It needs company name and email columns.', 'danger')
+            return render_template('campaign/new.html', form=form)
+        try:
+            compile_template(campaign.email_template, extra_fields)
+        except TemplateError as e:
             os.remove(file_path)
+            flash(str(e), 'danger')
+            return render_template('campaign/new.html', form=form)
         
+        # Parse and insert companies in the background
+        campaign.status = 'importing'
+        db.session.add(campaign)
         db.session.commit()
+        ingest_campaign_file.delay(campaign.id, file_path)
         
-        # Start campaign if auto-send
         if campaign.schedule_type == 'auto':
-            campaign.status = 'active'
-            db.session.commit()
-            start_email_campaign.delay(campaign.id)
-            flash('Campaign started! Emails will be sent within rate limits.', 'info')
+            flash('Campaign created! Companies are being imported and sending will start automatically.', 'info')
+        else:
+            flash('Campaign created! Companies are being imported.', 'info')
         
         return redirect(url_for('main.campaign_detail', campaign_id=campaign.id))
     
@@ -115,29 +110,49 @@ def new_campaign():
 def campaign_detail(campaign_id):
     campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
     
-    # Get email logs with company info
-    email_logs = db.session.query(EmailLog, Company).join(Company).filter(
-        EmailLog.campaign_id == campaign_id
-    ).order_by(EmailLog.created_at.desc()).all()
+    # One page of email logs with company info
+    status = request.args.get('status')
+    if status not in LOG_STATUS_FILTERS:
+        status = None
+    try:
+        email_logs, next_cursor = get_email_log_page(
+            campaign_id,
+            status=status,
+            cursor=request.args.get('cursor'),
+            limit=current_app.config['LOGS_PAGE_SIZE'],
+            archived=campaign.archived_at is not None
+        )
+    except ValueError:
+        return redirect(url_for('main.campaign_detail', campaign_id=campaign_id, status=status))
     
     # Statistics
-    stats = {
-        'total': len(email_logs),
-        'sent': len([log for log, _ in email_logs if log.status == 'sent']),
-        'pending': len([log for log, _ in email_logs if log.status == 'pending']),
-        'failed': len([log for log, _ in email_logs if log.status == 'failed']),
-    }
+    stats = campaign_email_stats(campaign_id)
+    
+    # Time the last XLSX export was built, if there is one
+    xlsx_path = export_path(campaign_id)
+    xlsx_exported_at = datetime.utcfromtimestamp(os.path.getmtime(xlsx_path)) if os.path.exists(xlsx_path) else None
     
-    return render_template('campaign/detail.html', campaign=campaign, email_logs=email_logs, stats=stats)
+    return render_template('campaign/detail.html', campaign=campaign, email_logs=email_logs, stats=stats,
+                           status_filter=status, next_cursor=next_cursor, paginated='cursor' in request.args,
+                           xlsx_exported_at=xlsx_exported_at)
 
 @bp.route('/campaign/<int:campaign_id>/start', methods=['POST'])
 @login_required
 def start_campaign(campaign_id):
     campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
     
-    if campaign.status == 'draft' or campaign.status == 'paused':
+    if campaign.status in ('draft', 'scheduled', 'paused'):
         campaign.status = 'active'
+        # The send tasks go by the status signal, so the change only
+        # counts once it is recorded there too
+        try:
+            set_campaign_status(campaign.id, 'active')
+        except redis.RedisError:
+            db.session.rollback()
+            flash('Could not start the campaign right now. Please try again.', 'danger')
+            return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
         db.session.commit()
+        publish_campaign_event(campaign.id, 'active')
         start_email_campaign.delay(campaign.id)
         flash('Campaign started!', 'success')
     else:
@@ -152,26 +167,133 @@ def pause_campaign(campaign_id):
     
     if campaign.status == 'active':
         campaign.status = 'paused'
+        try:
+            set_campaign_status(campaign.id, 'paused')
+        except redis.RedisError:
+            db.session.rollback()
+            flash('Could not pause the campaign right now. Please try again.', 'danger')
+            return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
         db.session.commit()
+        publish_campaign_event(campaign.id, 'paused')
         flash('Campaign paused.', 'info')
     else:
         flash('Campaign is not active.', 'warning')
     
     return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
 
+@bp.route('/campaign/<int:campaign_id>/export.csv')
+@login_required
+def export_campaign_csv(campaign_id):
+    campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
+    
+    # Streamed in batches as rows come off the cursor, whatever the campaign size
+    filename = f'campaign_{campaign.id}_results.csv'
+    return current_app.response_class(
+        stream_with_context(iter_export_csv(campaign.id, archived=campaign.archived_at is not None)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@bp.route('/campaign/<int:campaign_id>/export.xlsx', methods=['POST'])
+@login_required
+def request_campaign_xlsx(campaign_id):
+    campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
+    
+    # Workbooks of large campaigns take a while to build, so it's done in the background
+    export_campaign_xlsx.delay(campaign.id)
+    flash('The XLSX export is being prepared. Refresh this page in a moment to download it.', 'info')
+    return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
+
+@bp.route('/campaign/<int:campaign_id>/export.xlsx')
+@login_required
+def download_campaign_xlsx(campaign_id):
+    campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
+    
+    path = export_path(campaign.id)
+    if not os.path.exists(path):
+        flash('No XLSX export yet. Use Export XLSX to prepare one.', 'warning')
+        return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
+    return send_file(path, as_attachment=True, download_name=f'campaign_{campaign.id}_results.xlsx')
+
 @bp.route('/api/campaign/<int:campaign_id>/status')
 @login_required
 def campaign_status_api(campaign_id):
     campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
     
-    email_logs = EmailLog.query.filter_by(campaign_id=campaign_id).all()
+    # Every change to the campaign bumps its event version, so an unchanged
+    # version means the client's copy is still current. Versions carry an
+    # epoch, so one Redis lost and recreated never matches an old ETag.
+    version = get_campaign_version(campaign_id)
+    etag = f'{campaign_id}-{version}' if version is not None else None
+    if etag and etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        stats = campaign_email_stats(campaign_id)
+        stats['status'] = campaign.status
+        response = jsonify(stats)
     
-    stats = {
-        'total': len(email_logs),
-        'sent': len([log for log in email_logs if log.status == 'sent']),
-        'pending': len([log for log in email_logs if log.status == 'pending']),
-        'failed': len([log for log in email_logs if log.status == 'failed']),
-        'status': campaign.status
-    }
+    if etag:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@bp.route('/api/campaign/<int:campaign_id>/events')
+@login_required
+def campaign_events(campaign_id):
+    Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
     
-    return jsonify(stats)
+    return current_app.response_class(
+        stream_campaign_events(campaign_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/campaign/<int:campaign_id>/import')
+@login_required
+def campaign_import_api(campaign_id):
+    campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
+    
+    return jsonify({
+        'status': campaign.status,
+        'rows_parsed': campaign.rows_parsed or 0,
+        'rows_inserted': campaign.rows_inserted or 0,
+        'rows_rejected': campaign.rows_rejected or 0,
+        'rows_skipped': campaign.rows_skipped or 0,
+        'error': campaign.import_error,
+    })
+
+@bp.route('/api/campaign/<int:campaign_id>/logs')
+@login_required
+def campaign_logs_api(campaign_id):
+    campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
+    
+    status = request.args.get('status')
+    if status and status not in LOG_STATUS_FILTERS:
+        return jsonify({'error': 'Invalid status filter'}), 400
+    limit = min(
+        request.args.get('limit', current_app.config['LOGS_PAGE_SIZE'], type=int),
+        current_app.config['LOGS_MAX_PAGE_SIZE']
+    )
+    
+    try:
+        email_logs, next_cursor = get_email_log_page(
+            campaign_id,
+            status=status,
+            cursor=request.args.get('cursor'),
+            limit=max(limit, 1),
+            archived=campaign.archived_at is not None
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify({
+        'logs': [serialize_log(row) for row in email_logs],
+        'next_cursor': next_cursor,
+    })
+
+@bp.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint for this web process; workers serve their own
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return current_app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -1,154 +1,561 @@
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, task_postrun
 from config import Config
-import time
+from app.utils.events import publish_campaign_event
+from app.utils import metrics
+import os
 import random
+import redis
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 # Initialize Celery
 celery = Celery('applyflow')
 celery.config_from_object(Config)
 
-@celery.task(bind=True)
-def start_email_campaign(self, campaign_id):
+# Flask app shared by every task run in this process
+_app = None
+
+def get_app():
+    """
+    Return the worker's Flask app, creating it on first use. Building an app
+    means a new engine and connection pool, so tasks reuse this one instead
+    of calling create_app() per run.
+    """
+    global _app
+    if _app is None:
+        from app import create_app
+        _app = create_app()
+    return _app
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Set up the app in each pool process as it starts. Connections inherited
+    from the parent across fork are dropped, not closed, so the parent's
+    stay usable.
+    """
+    from app import db
+    
+    with get_app().app_context():
+        db.engine.dispose(close=False)
+    metrics.start_exporter()
+
+@worker_init.connect
+def init_worker(**kwargs):
+    """
+    Serve metrics from the main worker process, which runs the tasks
+    itself with the solo pool.
     """
-    Background task to send emails for a campaign with rate limiting.
+    metrics.start_exporter()
+
+@task_postrun.connect
+def flush_task_metrics(**kwargs):
+    metrics.flush_campaign_timings()
+
+def record_rate_limit(user_id, decision):
+    """
+    Copy the Redis rate limit counters onto the user's RateLimit row, which
+    is kept for reporting: a single UPDATE, creating the row if there is
+    none. Does not commit.
     """
-    from app import create_app, db
-    from app.models import Campaign, Company, EmailLog, RateLimit
-    from app.utils.email_sender import send_email_via_gmail, prepare_email_content
+    from app import db
+    from app.models import RateLimit
     
-    app = create_app()
+    values = {
+        'hour_start': decision.hour_start,
+        'day_start': decision.day_start,
+        'emails_this_hour': decision.emails_this_hour,
+        'emails_today': decision.emails_today,
+        'last_email_sent': decision.now,
+    }
+    updated = RateLimit.query.filter_by(user_id=user_id).update(values, synchronize_session=False)
+    if not updated:
+        db.session.add(RateLimit(user_id=user_id, **values))
+
+# Tasks that change a campaign's status are retried while Redis can't take
+# the new status signal, instead of leaving the old one in place
+STATUS_TASK_OPTIONS = {'autoretry_for': (redis.RedisError,), 'retry_backoff': True, 'max_retries': None}
+
+def commit_campaign_status(campaign_id, status):
+    """
+    Commit a status change made on the session, recording it in the
+    campaign's status signal first. On RedisError the change is rolled back
+    and the error raised, so the database and the signal never disagree.
+    """
+    from app import db
+    from app.utils.events import set_campaign_status
+    
+    try:
+        set_campaign_status(campaign_id, status)
+    except redis.RedisError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+
+def schedule_user_sends(user_id, token, countdown=0):
+    """
+    Queue the next run of the user's send chain `token` on their shard's
+    queue, extending the chain lease past the countdown so no second chain
+    is started. Does nothing if the chain no longer holds the lease.
+    """
+    from app.utils.scheduler import extend_chain, send_queue_for_user
+    
+    if extend_chain(user_id, token, countdown + Config.SEND_CHAIN_LEASE_SECONDS):
+        send_user_emails.apply_async((user_id, token), countdown=countdown, queue=send_queue_for_user(user_id))
+
+@celery.task
+def start_email_campaign(campaign_id):
+    """
+    Add an active campaign to its user's ready queue and make sure the
+    user's send chain is running.
+    """
+    from app.models import Campaign
+    from app.utils.scheduler import enqueue_campaign, claim_chain
+    
+    app = get_app()
     
     with app.app_context():
         campaign = Campaign.query.get(campaign_id)
         if not campaign or campaign.status != 'active':
             return
         
-        user_id = campaign.user_id
+        enqueue_campaign(campaign.user_id, campaign.id)
+        token = claim_chain(campaign.user_id, Config.SEND_CHAIN_LEASE_SECONDS)
+        if token:
+            schedule_user_sends(campaign.user_id, token)
+
+@lru_cache(maxsize=1024)
+def campaign_content(campaign_id):
+    """
+    A campaign's (email_template, resume_path), which don't change after it
+    is created, cached per worker process. None if there is no such campaign.
+    """
+    from app import db
+    from app.models import Campaign
+    
+    row = db.session.query(Campaign.email_template, Campaign.resume_path).filter_by(id=campaign_id).first()
+    return tuple(row) if row else None
+
+def active_campaign(user_id):
+    """
+    The first active campaign in the user's ready queue, dropping the ones
+    ahead of it that are no longer active. Statuses come from the Redis
+    status signals, falling back to the database for missing ones.
+    """
+    from app.models import Campaign
+    from app.utils.events import get_campaign_statuses, seed_campaign_status
+    from app.utils.scheduler import ready_campaigns, remove_campaign
+    
+    campaign_ids = ready_campaigns(user_id)
+    for campaign_id, status in zip(campaign_ids, get_campaign_statuses(campaign_ids)):
+        if status is None:
+            campaign = Campaign.query.get(campaign_id)
+            status = campaign.status if campaign else None
+            if status:
+                seed_campaign_status(campaign_id, status)
+        if status == 'active':
+            return campaign_id
+        remove_campaign(user_id, campaign_id)
+    return None
+
+@celery.task
+def send_user_emails(user_id, token=None):
+    """
+    Background task to send emails for a user's active campaigns with rate limiting.
+    
+    Each run claims and sends at most one email, taken from the campaign at
+    the front of the user's ready queue, and then re-enqueues itself with a countdown
+    computed from the Redis rate limiter. The worker is free between sends,
+    and each user has exactly one run queued at a time whatever the number
+    or size of their campaigns.
+    
+    Campaign statuses are read from their Redis status signals, checked
+    again right before sending, so a pause takes effect before the next
+    email without the campaign row being read on every run.
+    
+    A run that fails re-enqueues the chain SEND_ERROR_RETRY_SECONDS later
+    before the error propagates, so one error never ends the user's
+    sending; chains lost altogether are revived by revive_send_chains.
+    Runs carry their chain's token and stop if another chain has taken
+    over the lease, e.g. when they were delivered late.
+    """
+    from app import db
+    from app.utils.scheduler import owns_chain
+    
+    if token is None or not owns_chain(user_id, token):
+        return
+    
+    app = get_app()
+    
+    with app.app_context():
+        try:
+            send_next_email(user_id, token)
+        except Exception:
+            db.session.rollback()
+            schedule_user_sends(user_id, token, Config.SEND_ERROR_RETRY_SECONDS)
+            raise
+
+def send_next_email(user_id, token):
+    """
+    One run of the user's send chain (see send_user_emails). Needs an app
+    context.
+    """
+    from app import db
+    from app.models import Campaign
+    from app.utils.email_sender import send_email, prepare_email_content
+    from app.utils.events import get_campaign_statuses
+    from app.utils.mail_transport import failure_kind, QUOTA, TRANSIENT
+    from app.utils.rate_limiter import (
+        acquire_send_slot, release_send_slot, seconds_until, defer_user_sends, backoff_seconds
+    )
+    from app.utils.email_claims import claim_email_logs, release_email_logs, count_in_flight, next_retry_at
+    from app.utils.recipients import record_contacted
+    from app.utils.scheduler import (
+        ready_campaigns, remove_campaign, charge_campaign, claim_chain, release_chain
+    )
+    
+    # Next active campaign in the user's ready queue
+    campaign_id = active_campaign(user_id)
+    
+    if campaign_id is None:
+        # Nothing left to send; re-check after releasing in case a
+        # campaign was started in the meantime
+        release_chain(user_id, token)
+        if ready_campaigns(user_id):
+            token = claim_chain(user_id, Config.SEND_CHAIN_LEASE_SECONDS)
+            if token:
+                schedule_user_sends(user_id, token)
+        return
+    
+    metrics.bind_campaign(campaign_id)
+    
+    # Check rate limits and take a send slot in one Redis round trip,
+    # before touching the database
+    delay = random.randint(Config.MIN_DELAY_SECONDS, Config.MAX_DELAY_SECONDS)
+    with metrics.timed('rate_limit'):
+        decision = acquire_send_slot(user_id, delay)
+    
+    if not decision.allowed:
+        metrics.inc('rate_limited_total', reason=decision.reason)
+        metrics.observe('rate_limit_wait_seconds', seconds_until(decision), reason=decision.reason)
+        if decision.reason == 'day':
+            # Pause the user's campaigns until the daily limit resets
+            for queued_id in ready_campaigns(user_id):
+                queued = Campaign.query.get(queued_id)
+                if queued and queued.status == 'active':
+                    queued.status = 'paused'
+                    commit_campaign_status(queued_id, 'paused')
+                    publish_campaign_event(queued_id, 'paused', reason='daily_limit')
+                    resume_campaign.apply_async((queued_id,), eta=decision.retry_at)
+                remove_campaign(user_id, queued_id)
+            release_chain(user_id, token)
+            return
         
-        # Get or create rate limit tracker
-        rate_limit = RateLimit.query.filter_by(user_id=user_id).first()
-        if not rate_limit:
-            rate_limit = RateLimit(
-                user_id=user_id,
-                hour_start=datetime.utcnow(),
-                day_start=datetime.utcnow(),
-                emails_this_hour=0,
-                emails_today=0
-            )
-            db.session.add(rate_limit)
+        # Hourly limit or gap between emails: come back when allowed
+        schedule_user_sends(user_id, token, seconds_until(decision))
+        return
+    
+    # Claim the next pending email with its company (pending -> sending),
+    # so no other worker can send it while we hold the lease
+    with metrics.timed('claim'):
+        claimed = claim_email_logs(campaign_id)
+    
+    if not claimed:
+        release_send_slot(user_id)
+        retry_at = next_retry_at(campaign_id)
+        if retry_at or count_in_flight(campaign_id):
+            # Emails are waiting out a retry backoff, or another worker is
+            # still sending this campaign's last ones; look again later
+            # and let the user's other campaigns go first
+            countdown = Config.MIN_DELAY_SECONDS
+            if retry_at:
+                countdown = min(countdown, int((retry_at - datetime.utcnow()).total_seconds()) + 1)
+            charge_campaign(user_id, campaign_id)
+            schedule_user_sends(user_id, token, max(1, countdown))
+            return
+        completed = Campaign.query.filter_by(id=campaign_id, status='active').update({'status': 'completed'})
+        if completed:
+            commit_campaign_status(campaign_id, 'completed')
+        else:
             db.session.commit()
+        remove_campaign(user_id, campaign_id)
+        if completed:
+            publish_campaign_event(campaign_id, 'completed')
+        schedule_user_sends(user_id, token)
+        return
+    
+    email_log, company = claimed[0]
+    
+    content = campaign_content(campaign_id)
+    if not company or not content:
+        release_send_slot(user_id)
+        email_log.status = 'failed'
+        email_log.claimed_at = None
+        email_log.error_message = 'Company not found'
+        db.session.commit()
+        publish_campaign_event(campaign_id, 'failed', log_id=email_log.id)
+        schedule_user_sends(user_id, token)
+        return
+    email_template, resume_path = content
+    
+    # Prepare email
+    company_data = {
+        **(company.extra_fields or {}),
+        'company_name': company.company_name,
+        'recipient_name': company.recipient_name or 'Hiring Manager',
+        'role': company.role or '',
+        'designation': company.designation or '',
+    }
+    
+    subject, body = prepare_email_content(email_template, company_data)
+    
+    # Last check before sending: a pause since this run started wins
+    # (one Redis GET). The next run drops the campaign from the queue.
+    if get_campaign_statuses([campaign_id])[0] not in (None, 'active'):
+        release_send_slot(user_id)
+        release_email_logs([email_log])
+        db.session.commit()
+        schedule_user_sends(user_id, token)
+        return
+    
+    # Send email
+    success, error = send_email(
+        to_email=company.recipient_email,
+        subject=subject,
+        body=body,
+        resume_path=resume_path
+    )
+    
+    # Update email log; the log, the RateLimit mirror and the contacted
+    # index all go out in the one commit below
+    email_log.attempts = (email_log.attempts or 0) + 1
+    email_log.claimed_at = None
+    countdown = delay
+    if success:
+        email_log.status = 'sent'
+        email_log.sent_at = datetime.utcnow()
+        email_log.next_attempt_at = None
+        record_rate_limit(user_id, decision)
+        record_contacted(user_id, company.recipient_email, campaign_id)
+        charge_campaign(user_id, campaign_id)
+    else:
+        # Failed sends don't count towards the limits
+        release_send_slot(user_id)
+        kind = failure_kind(error)
+        retry_after = getattr(error, 'retry_after', None) or 0
+        email_log.error_kind = kind
+        email_log.error_message = error
+        countdown = 0
         
-        # Reset counters if needed
-        now = datetime.utcnow()
-        if now - rate_limit.hour_start >= timedelta(hours=1):
-            rate_limit.hour_start = now
-            rate_limit.emails_this_hour = 0
+        if kind == QUOTA:
+            # Back off all of the user's sending. The email is kept, but
+            # waits out its own backoff as well, so an email that keeps
+            # hitting the limit lets the others go first and eventually fails
+            countdown = defer_user_sends(user_id, retry_after)
+            if email_log.attempts < Config.SEND_MAX_ATTEMPTS:
+                email_log.status = 'pending'
+                wait = max(backoff_seconds(email_log.attempts), countdown)
+                email_log.next_attempt_at = datetime.utcnow() + timedelta(seconds=wait)
+            else:
+                email_log.status = 'failed'
+        elif kind == TRANSIENT and email_log.attempts < Config.SEND_MAX_ATTEMPTS:
+            email_log.status = 'pending'
+            wait = max(backoff_seconds(email_log.attempts), retry_after)
+            email_log.next_attempt_at = datetime.utcnow() + timedelta(seconds=wait)
+        else:
+            email_log.status = 'failed'
+    
+    with metrics.timed('db_commit'):
+        db.session.commit()
+    event = 'retry' if email_log.status == 'pending' else email_log.status
+    metrics.inc('emails_total', result=event)
+    publish_campaign_event(campaign_id, event, log_id=email_log.id, attempts=email_log.attempts)
+    
+    # Random delay between emails (60-300 seconds) after a send,
+    # none after a failure unless the user is backing off
+    schedule_user_sends(user_id, token, countdown)
+
+@celery.task
+def revive_send_chains():
+    """
+    Restart the send chain of users who have active campaigns but no chain
+    running, e.g. after a worker crash lost the queued run. Run every
+    SEND_SWEEP_INTERVAL_SECONDS by celery beat. A chain's lease outlives its
+    next run by SEND_CHAIN_LEASE_SECONDS, so live chains are left alone.
+    """
+    from app import db
+    from app.models import Campaign
+    from app.utils.scheduler import enqueue_campaign, claim_chain, users_without_chain
+    
+    app = get_app()
+    
+    with app.app_context():
+        active = db.session.query(Campaign.user_id, Campaign.id).filter(Campaign.status == 'active').all()
+        campaigns_by_user = {}
+        for user_id, campaign_id in active:
+            campaigns_by_user.setdefault(user_id, []).append(campaign_id)
         
-        if now - rate_limit.day_start >= timedelta(days=1):
-            rate_limit.day_start = now
-            rate_limit.emails_today = 0
+        for user_id in users_without_chain(campaigns_by_user):
+            for campaign_id in campaigns_by_user[user_id]:
+                enqueue_campaign(user_id, campaign_id)
+            token = claim_chain(user_id, Config.SEND_CHAIN_LEASE_SECONDS)
+            if token:
+                schedule_user_sends(user_id, token)
+
+@celery.task
+def ingest_campaign_file(campaign_id, file_path):
+    """
+    Background task to parse a campaign's companies file and insert the
+    companies and pending email logs, recording progress on the campaign.
+    finish_campaign_import then gives the campaign its next status.
+    """
+    from app import db
+    from app.models import Campaign
+    from app.utils.file_parser import iter_companies_file, ImportReport
+    from app.utils.ingest import ingest_companies
+    from app.utils.recipients import ContactedIndex
+    
+    app = get_app()
+    
+    with app.app_context():
+        campaign = Campaign.query.get(campaign_id)
+        if not campaign or campaign.status != 'importing':
+            return
         
-        db.session.commit()
+        metrics.bind_campaign(campaign.id)
+        report = ImportReport()
         
-        # Get pending emails
-        pending_logs = EmailLog.query.filter_by(
-            campaign_id=campaign_id,
-            status='pending'
-        ).all()
+        # Recipients this user already emailed, checked per batch in memory
+        contacted = None
+        if Config.SKIP_CONTACTED_RECIPIENTS:
+            contacted = ContactedIndex.load(campaign.user_id)
         
-        if not pending_logs:
-            campaign.status = 'completed'
+        def progress(inserted):
+            campaign.rows_parsed = report.total_rows
+            campaign.rows_inserted = inserted
+            campaign.rows_rejected = report.rejected_count
+            if contacted is not None:
+                report.already_contacted = contacted.skipped
+                campaign.rows_skipped = contacted.skipped
             db.session.commit()
-            return
+            publish_campaign_event(campaign.id, 'import_progress', rows_inserted=inserted)
         
-        # Send emails with rate limiting
-        for email_log in pending_logs:
-            # Check if campaign is still active
-            db.session.refresh(campaign)
-            if campaign.status != 'active':
-                break
-            
-            # Check rate limits
-            db.session.refresh(rate_limit)
-            if rate_limit.emails_this_hour >= Config.MAX_EMAILS_PER_HOUR:
-                # Wait until next hour
-                wait_time = 3600 - (datetime.utcnow() - rate_limit.hour_start).total_seconds()
-                if wait_time > 0:
-                    time.sleep(wait_time)
-                rate_limit.hour_start = datetime.utcnow()
-                rate_limit.emails_this_hour = 0
-                db.session.commit()
-            
-            if rate_limit.emails_today >= Config.MAX_EMAILS_PER_DAY:
-                # Pause campaign until tomorrow
-                campaign.status = 'paused'
-                db.session.commit()
-                # Schedule to resume tomorrow
-                resume_time = (datetime.utcnow() + timedelta(days=1)).replace(hour=9, minute=0, second=0)
-                resume_campaign.apply_async((campaign_id,), eta=resume_time)
-                break
-            
-            # Get company data
-            company = Company.query.get(email_log.company_id)
-            if not company:
-                continue
-            
-            # Prepare email
-            company_data = {
-                'company_name': company.company_name,
-                'recipient_name': company.recipient_name or 'Hiring Manager',
-                'role': company.role or '',
-                'designation': company.designation or '',
-            }
-            
-            subject, body = prepare_email_content(campaign.email_template, company_data)
-            
-            # Send email
-            success, error = send_email_via_gmail(
-                to_email=company.recipient_email,
-                subject=subject,
-                body=body,
-                resume_path=campaign.resume_path
+        try:
+            result = ingest_companies(
+                campaign.id,
+                campaign.user_id,
+                iter_companies_file(file_path, report),
+                progress=progress,
+                exclude=contacted
             )
-            
-            # Update email log
-            if success:
-                email_log.status = 'sent'
-                email_log.sent_at = datetime.utcnow()
-                rate_limit.emails_this_hour += 1
-                rate_limit.emails_today += 1
-                rate_limit.last_email_sent = datetime.utcnow()
-            else:
-                email_log.status = 'failed'
-                email_log.error_message = error
-            
-            db.session.commit()
-            
-            # Random delay between emails (60-300 seconds)
-            if success:
-                delay = random.randint(Config.MIN_DELAY_SECONDS, Config.MAX_DELAY_SECONDS)
-                time.sleep(delay)
+            progress(result['inserted'])
+            campaign.import_error = report.error
+        except Exception as e:
+            db.session.rollback()
+            campaign.import_error = f"Error importing companies: {str(e)}"
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        db.session.commit()
         
-        # Check if campaign is complete
-        remaining = EmailLog.query.filter_by(campaign_id=campaign_id, status='pending').count()
-        if remaining == 0:
-            campaign.status = 'completed'
-            db.session.commit()
+        # In a task of its own, so it can be retried without importing again
+        finish_campaign_import.delay(campaign.id)
 
-@celery.task
+@celery.task(**STATUS_TASK_OPTIONS)
+def finish_campaign_import(campaign_id):
+    """
+    Move an imported campaign out of 'importing': start it if auto-send, or
+    leave it to the dispatcher if scheduled. An import that stopped partway
+    stays a draft, so a partial list is never sent before the user has seen
+    the error.
+    """
+    from app.models import Campaign
+    
+    app = get_app()
+    
+    with app.app_context():
+        campaign = Campaign.query.get(campaign_id)
+        if not campaign or campaign.status != 'importing':
+            return
+        
+        complete = campaign.rows_inserted and not campaign.import_error
+        if campaign.schedule_type == 'auto' and complete:
+            campaign.status = 'active'
+        elif campaign.schedule_type == 'scheduled' and campaign.scheduled_time and complete:
+            campaign.status = 'scheduled'
+        else:
+            campaign.status = 'draft'
+        commit_campaign_status(campaign.id, campaign.status)
+        publish_campaign_event(campaign.id, campaign.status)
+        if campaign.status == 'active':
+            start_email_campaign.delay(campaign.id)
+
+@celery.task(**STATUS_TASK_OPTIONS)
 def resume_campaign(campaign_id):
     """
     Resume a paused campaign.
     """
-    from app import create_app, db
     from app.models import Campaign
     
-    app = create_app()
+    app = get_app()
     
     with app.app_context():
         campaign = Campaign.query.get(campaign_id)
         if campaign and campaign.status == 'paused':
             campaign.status = 'active'
-            db.session.commit()
+            commit_campaign_status(campaign_id, 'active')
+            publish_campaign_event(campaign_id, 'active')
             start_email_campaign.delay(campaign_id)
+
+@celery.task(**STATUS_TASK_OPTIONS)
+def dispatch_scheduled_campaigns():
+    """
+    Start the scheduled campaigns that are due. Run every
+    DISPATCH_INTERVAL_SECONDS by celery beat; several beat instances can run
+    it at once, as each due campaign is claimed by exactly one of them.
+    """
+    from app.utils.dispatch import claim_due_campaigns
+    
+    app = get_app()
+    
+    with app.app_context():
+        while True:
+            campaign_ids = claim_due_campaigns()
+            for campaign_id in campaign_ids:
+                publish_campaign_event(campaign_id, 'active', reason='scheduled')
+                start_email_campaign.delay(campaign_id)
+            if len(campaign_ids) < Config.DISPATCH_BATCH_SIZE:
+                return
+
+@celery.task
+def rollup_email_logs():
+    """
+    Roll up and archive the email logs of campaigns completed more than
+    ARCHIVE_AFTER_DAYS ago, ROLLUP_BATCH_SIZE campaigns per run. Run every
+    ROLLUP_INTERVAL_SECONDS by celery beat.
+    """
+    from app.utils.archive import rollup_email_logs as rollup
+    
+    app = get_app()
+    
+    with app.app_context():
+        return rollup()
+
+@celery.task
+def export_campaign_xlsx(campaign_id):
+    """
+    Build a campaign's XLSX results export in the background and announce it
+    with an export_ready event.
+    """
+    from app.models import Campaign
+    from app.utils.export import write_export_xlsx
+    
+    app = get_app()
+    
+    with app.app_context():
+        campaign = Campaign.query.get(campaign_id)
+        if not campaign:
+            return
+        write_export_xlsx(campaign_id, archived=campaign.archived_at is not None)
+        publish_campaign_event(campaign_id, 'export_ready')
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, literal
+from config import Config
+from app import db
+from app.models import Campaign, EmailLog, ArchivedEmailLog, EmailLogSummary
+
+# Columns copied from email_logs into the archive
+ARCHIVED_COLUMNS = (
+    'id', 'campaign_id', 'company_id', 'user_id', 'status', 'attempts',
+    'error_kind', 'error_message', 'sent_at', 'created_at',
+)
+
+def archivable_campaigns(limit=None, now=None):
+    """
+    IDs of completed campaigns left untouched for ARCHIVE_AFTER_DAYS whose
+    email logs have not been archived yet, oldest first.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+    query = (
+        select(Campaign.id)
+        .where(Campaign.status == 'completed', Campaign.archived_at.is_(None), Campaign.updated_at <= cutoff)
+        .order_by(Campaign.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    return db.session.execute(query).scalars().all()
+
+def archive_campaign(campaign_id, now=None):
+    """
+    Roll a completed campaign's email logs up into per-day, per-status
+    summaries and move them to the archive table, in one transaction.
+    Returns the number of logs archived, or None if the campaign can't be
+    archived (not completed, or already taken by another rollup). Commits.
+    """
+    now = now or datetime.utcnow()
+    
+    # Mark the campaign first: the guarded UPDATE locks its row, so
+    # concurrent rollups skip it
+    marked = db.session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status == 'completed', Campaign.archived_at.is_(None))
+        .values(archived_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not marked:
+        db.session.rollback()
+        return None
+    
+    day = func.date(func.coalesce(EmailLog.sent_at, EmailLog.created_at))
+    db.session.execute(
+        insert(EmailLogSummary).from_select(
+            ['campaign_id', 'user_id', 'day', 'status', 'count'],
+            select(EmailLog.campaign_id, EmailLog.user_id, day, EmailLog.status, func.count(EmailLog.id))
+            .where(EmailLog.campaign_id == campaign_id)
+            .group_by(EmailLog.campaign_id, EmailLog.user_id, day, EmailLog.status)
+        )
+    )
+    
+    columns = [getattr(EmailLog, name) for name in ARCHIVED_COLUMNS]
+    archived = db.session.execute(
+        insert(ArchivedEmailLog).from_select(
+            list(ARCHIVED_COLUMNS) + ['archived_at'],
+            select(*columns, literal(now, ArchivedEmailLog.archived_at.type)).where(EmailLog.campaign_id == campaign_id)
+        )
+    ).rowcount
+    db.session.execute(
+        delete(EmailLog).where(EmailLog.campaign_id == campaign_id).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return archived
+
+def rollup_email_logs(limit=None):
+    """
+    Archive up to `limit` (Config.ROLLUP_BATCH_SIZE) archivable campaigns.
+    Returns (campaigns archived, email logs moved).
+    """
+    campaigns = logs = 0
+    for campaign_id in archivable_campaigns(limit or Config.ROLLUP_BATCH_SIZE):
+        archived = archive_campaign(campaign_id)
+        if archived is not None:
+            campaigns += 1
+            logs += archived
+    return campaigns, logs
@@ -0,0 +1,50 @@
+import redis
+from datetime import datetime
+from sqlalchemy import select, update
+from config import Config
+from app import db
+from app.models import Campaign
+from app.utils.events import set_campaign_status
+
+def claim_due_campaigns(limit=None, now=None):
+    """
+    Atomically move up to `limit` (Config.DISPATCH_BATCH_SIZE) scheduled
+    campaigns whose time has come to 'active', and return their IDs. Due
+    campaigns are found through the (status, scheduled_time) index, so a
+    tick costs the same however many campaigns are scheduled for later.
+    Rows are locked with FOR UPDATE SKIP LOCKED and the UPDATE re-checks
+    the status, so concurrent dispatchers each start a campaign at most
+    once between them. The claimed campaigns' status signals are set before
+    the claim is committed; on RedisError it is rolled back and the error
+    raised. Commits the claim.
+    """
+    limit = limit or Config.DISPATCH_BATCH_SIZE
+    now = now or datetime.utcnow()
+    due = (Campaign.status == 'scheduled', Campaign.scheduled_time <= now)
+    
+    candidates = db.session.execute(
+        select(Campaign.id)
+        .where(*due)
+        .order_by(Campaign.scheduled_time)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not candidates:
+        db.session.commit()
+        return []
+    
+    claimed = db.session.execute(
+        update(Campaign)
+        .where(Campaign.id.in_(candidates), *due)
+        .values(status='active')
+        .returning(Campaign.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    try:
+        for campaign_id in claimed:
+            set_campaign_status(campaign_id, 'active')
+    except redis.RedisError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return sorted(claimed)
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, and_, or_
+from config import Config
+from app import db
+from app.models import EmailLog, Company
+
+def _claimable(campaign_id, now, lease_seconds):
+    """
+    Filter for a campaign's logs that can be claimed: pending ones whose
+    retry time (if any) has come, and ones left in 'sending' by a worker
+    whose lease has run out.
+    """
+    expired = now - timedelta(seconds=lease_seconds)
+    return and_(
+        EmailLog.campaign_id == campaign_id,
+        or_(
+            and_(
+                EmailLog.status == 'pending',
+                or_(EmailLog.next_attempt_at.is_(None), EmailLog.next_attempt_at <= now)
+            ),
+            and_(EmailLog.status == 'sending', EmailLog.claimed_at < expired)
+        )
+    )
+
+def claim_email_logs(campaign_id, limit=1, lease_seconds=None):
+    """
+    Atomically move up to `limit` of a campaign's pending email logs to
+    'sending' and return them with their companies, as (EmailLog, Company)
+    pairs oldest first. Candidate rows are locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers claim disjoint
+    rows without waiting on each other. A claim that is not finished within
+    `lease_seconds` (Config.SEND_CLAIM_LEASE_SECONDS) can be taken again.
+    Commits the claim.
+    """
+    lease_seconds = lease_seconds if lease_seconds is not None else Config.SEND_CLAIM_LEASE_SECONDS
+    now = datetime.utcnow()
+    
+    candidates = db.session.execute(
+        select(EmailLog.id)
+        .where(_claimable(campaign_id, now, lease_seconds))
+        .order_by(EmailLog.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not candidates:
+        db.session.commit()
+        return []
+    
+    # Re-check the claim condition in the UPDATE as well, for databases
+    # without row locks (SQLite)
+    claimed = db.session.execute(
+        update(EmailLog)
+        .where(EmailLog.id.in_(candidates), _claimable(campaign_id, now, lease_seconds))
+        .values(status='sending', claimed_at=now)
+        .returning(EmailLog.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    db.session.commit()
+    
+    if not claimed:
+        return []
+    # Logs and their companies in one query; Company is None if it is gone
+    return (
+        db.session.query(EmailLog, Company)
+        .outerjoin(Company, Company.id == EmailLog.company_id)
+        .filter(EmailLog.id.in_(claimed))
+        .order_by(EmailLog.id)
+        .all()
+    )
+
+def release_email_logs(email_logs):
+    """
+    Give claimed email logs back as pending, e.g. when the rate limiter
+    refused the send. Does not commit.
+    """
+    for email_log in email_logs:
+        if email_log.status == 'sending':
+            email_log.status = 'pending'
+            email_log.claimed_at = None
+
+def count_in_flight(campaign_id, lease_seconds=None):
+    """
+    Number of the campaign's logs currently claimed under a live lease.
+    """
+    lease_seconds = lease_seconds if lease_seconds is not None else Config.SEND_CLAIM_LEASE_SECONDS
+    expired = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    return EmailLog.query.filter(
+        EmailLog.campaign_id == campaign_id,
+        EmailLog.status == 'sending',
+        EmailLog.claimed_at >= expired
+    ).count()
+
+def next_retry_at(campaign_id):
+    """
+    Earliest retry time among the campaign's pending logs waiting out a
+    backoff, or None if there are none.
+    """
+    return db.session.query(func.min(EmailLog.next_attempt_at)).filter(
+        EmailLog.campaign_id == campaign_id,
+        EmailLog.status == 'pending',
+        EmailLog.next_attempt_at > datetime.utcnow()
+    ).scalar()
@@ -0,0 +1,91 @@
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+from app import db
+from app.models import EmailLog, ArchivedEmailLog, Company
+from app.utils.stats import STATUS_ALIASES
+
+def log_columns(model=EmailLog):
+    """
+    Columns shown in the campaign log table, from email_logs or the archive;
+    rows come back as plain tuples.
+    """
+    return (
+        model.id,
+        model.status,
+        model.sent_at,
+        model.error_message,
+        model.created_at,
+        Company.company_name,
+        Company.recipient_email,
+    )
+
+# Columns of the live email logs
+LOG_COLUMNS = log_columns()
+
+def encode_cursor(created_at, log_id):
+    """
+    Opaque pagination cursor for the position after (created_at, id).
+    """
+    raw = f'{created_at.isoformat()}|{log_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor. Raises ValueError for malformed cursors.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, log_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(log_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def get_email_log_page(campaign_id, status=None, cursor=None, limit=50, archived=False):
+    """
+    One page of a campaign's email logs, newest first, with company info.
+    Uses keyset pagination on (created_at, id), so the cost of a page depends
+    on the page size, not on how far into the campaign it is. Reads the
+    archive table for `archived` campaigns.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    model = ArchivedEmailLog if archived else EmailLog
+    query = db.session.query(*log_columns(model)).join(
+        Company, Company.id == model.company_id
+    ).filter(model.campaign_id == campaign_id)
+    
+    if status:
+        # Filtering by 'pending' also finds claimed emails, as the stats count them
+        statuses = [status] + [alias for alias, shown in STATUS_ALIASES.items() if shown == status]
+        query = query.filter(model.status.in_(statuses))
+    
+    if cursor:
+        created_at, log_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < log_id)
+        ))
+    
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    
+    return rows, next_cursor
+
+def serialize_log(row):
+    """
+    JSON-friendly dict for one row from get_email_log_page.
+    """
+    return {
+        'id': row.id,
+        'company_name': row.company_name,
+        'recipient_email': row.recipient_email,
+        'status': row.status,
+        'sent_at': row.sent_at.isoformat() if row.sent_at else None,
+        'error_message': row.error_message,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+    }
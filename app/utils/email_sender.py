@@ -1,5 +1,8 @@
 import os
-import base64
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -8,17 +11,60 @@ from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from config import Config
+from app.utils.template_engine import compile_template
+from app.utils.metrics import timed
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
-def get_gmail_service():
+# Refresh access tokens this long before they actually expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Per-process Gmail credentials, keyed by token file, each with its own lock
+# for loading and refreshing them. Services are built per thread on top of
+# the shared credentials, since their HTTP client isn't thread-safe.
+_service_cache = {}
+_service_cache_lock = threading.Lock()
+_service_cache_stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'builds': 0}
+_thread_services = threading.local()
+
+# Per-process LRU of encoded attachment parts, keyed by (path, mtime, size)
+_attachment_cache = OrderedDict()
+_attachment_cache_lock = threading.Lock()
+_attachment_cache_stats = {'hits': 0, 'misses': 0, 'bytes': 0}
+
+def _save_token(creds, token_file):
     """
-    Authenticate and return Gmail API service.
+    Write credentials to the token file atomically, so a concurrent reader
+    never sees a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(token_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.token-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as token:
+            token.write(creds.to_json())
+        os.replace(tmp_path, token_file)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _needs_refresh(creds):
+    """
+    True if the access token is missing, expired or about to expire.
+    """
+    if not creds.token or not creds.expiry:
+        return not creds.valid
+    return creds.expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
+def get_gmail_credentials():
+    """
+    Load Gmail credentials from the token file, refreshing or running the
+    OAuth flow if they are not valid.
     """
     creds = None
-    token_file = 'token.json'
-    credentials_file = 'credentials.json'
+    token_file = Config.GMAIL_TOKEN_FILE
+    credentials_file = Config.GMAIL_CREDENTIALS_FILE
     
     # Load existing token
     if os.path.exists(token_file):
@@ -37,83 +83,195 @@ def get_gmail_service():
             creds = flow.run_local_server(port=0)
         
         # Save credentials
-        with open(token_file, 'w') as token:
-            token.write(creds.to_json())
+        _save_token(creds, token_file)
     
-    return build('gmail', 'v1', credentials=creds)
+    return creds
 
-def send_email_via_gmail(to_email, subject, body, resume_path=None):
+def get_gmail_service():
     """
-    Send email using Gmail API.
-    Returns (success: bool, error_message: str or None)
+    Authenticate and return Gmail API service.
     """
-    try:
-        service = get_gmail_service()
-        
-        # Create message
-        message = MIMEMultipart()
-        message['to'] = to_email
-        message['subject'] = subject
-        
-        # Add body
-        message.attach(MIMEText(body, 'plain'))
+    return build('gmail', 'v1', credentials=get_gmail_credentials())
+
+def _cached_credentials(token_file):
+    """
+    Shared credentials for a token file, valid for at least
+    TOKEN_REFRESH_MARGIN. Loading and refreshing hold only that token's
+    lock, so a slow refresh or auth flow doesn't block other token files.
+    """
+    with _service_cache_lock:
+        entry = _service_cache.get(token_file)
+        if entry is None:
+            entry = _service_cache[token_file] = {'creds': None, 'lock': threading.Lock()}
+    
+    with entry['lock']:
+        creds = entry['creds']
         
-        # Attach resume if provided
-        if resume_path and os.path.exists(resume_path):
-            with open(resume_path, 'rb') as f:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename={os.path.basename(resume_path)}'
-                )
-                message.attach(part)
+        # Tokens without a refresh token can't be renewed silently, so
+        # treat them as a miss and go through the full auth flow again
+        if creds and _needs_refresh(creds) and not creds.refresh_token:
+            creds = None
         
-        # Encode message
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+        if creds is None:
+            creds = get_gmail_credentials()
+            entry['creds'] = creds
+            _count_service_cache('misses')
+            return creds
         
-        # Send message
-        send_message = service.users().messages().send(
-            userId='me',
-            body={'raw': raw_message}
-        ).execute()
+        _count_service_cache('hits')
+        if _needs_refresh(creds):
+            creds.refresh(Request())
+            _save_token(creds, token_file)
+            _count_service_cache('refreshes')
         
-        return True, None
+        return creds
+
+def _count_service_cache(stat):
+    with _service_cache_lock:
+        _service_cache_stats[stat] += 1
+
+def get_cached_gmail_service():
+    """
+    Return a Gmail API service reused across sends by the calling thread.
+    The token file is only read on the first call in the process and the
+    access token is refreshed in place shortly before it expires; each
+    thread builds its own service (and HTTP connection) on top of those
+    credentials once.
+    """
+    token_file = Config.GMAIL_TOKEN_FILE
+    creds = _cached_credentials(token_file)
     
-    except HttpError as error:
-        return False, f"Gmail API error: {error}"
-    except Exception as e:
-        return False, f"Error sending email: {str(e)}"
+    services = getattr(_thread_services, 'services', None)
+    if services is None:
+        services = _thread_services.services = {}
+    
+    # Rebuild when the shared credentials were replaced (new auth flow
+    # or clear_service_cache)
+    cached = services.get(token_file)
+    if cached is None or cached[0] is not creds:
+        cached = services[token_file] = (creds, build('gmail', 'v1', credentials=creds))
+        _count_service_cache('builds')
+    
+    return cached[1]
 
-def prepare_email_content(template, company_data):
+def get_service_cache_stats():
     """
-    Replace placeholders in email template with company data.
+    Return hit/miss/refresh/build counters for the Gmail service cache.
     """
-    content = template
+    with _service_cache_lock:
+        return dict(_service_cache_stats)
+
+def clear_service_cache():
+    """
+    Drop cached Gmail credentials, e.g. after the token file was replaced.
+    Each thread rebuilds its service on its next send.
+    """
+    with _service_cache_lock:
+        _service_cache.clear()
+
+def _encode_attachment(path):
+    """
+    Read a file and build its base64-encoded MIME attachment part.
+    """
+    with open(path, 'rb') as f:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(f.read())
+        encoders.encode_base64(part)
+        part.add_header(
+            'Content-Disposition',
+            f'attachment; filename={os.path.basename(path)}'
+        )
+    return part
+
+def get_attachment_part(path):
+    """
+    Return the encoded MIME part for an attachment, reading and encoding the
+    file only once while it is unchanged. Entries are evicted least recently
+    used first once ATTACHMENT_CACHE_BYTES is exceeded.
+    The returned part is shared between messages and must not be modified.
+    """
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
     
-    # Replace placeholders
-    replacements = {
-        '{company_name}': company_data.get('company_name', ''),
-        '{recipient_name}': company_data.get('recipient_name', 'Hiring Manager'),
-        '{role}': company_data.get('role', ''),
-        '{designation}': company_data.get('designation', ''),
-    }
+    with _attachment_cache_lock:
+        entry = _attachment_cache.get(key)
+        if entry is not None:
+            _attachment_cache.move_to_end(key)
+            _attachment_cache_stats['hits'] += 1
+            return entry[0]
+        _attachment_cache_stats['misses'] += 1
     
-    for placeholder, value in replacements.items():
-        content = content.replace(placeholder, value)
+    part = _encode_attachment(path)
+    size = len(part.get_payload())
+    budget = Config.ATTACHMENT_CACHE_BYTES
     
-    # Extract subject and body
-    lines = content.split('\n')
-    subject = ''
-    body_lines = []
+    with _attachment_cache_lock:
+        # Drop older versions of the same file
+        for stale_key in [k for k in _attachment_cache if k[0] == path and k != key]:
+            _attachment_cache_stats['bytes'] -= _attachment_cache.pop(stale_key)[1]
+        
+        if size <= budget and key not in _attachment_cache:
+            _attachment_cache[key] = (part, size)
+            _attachment_cache_stats['bytes'] += size
+            while _attachment_cache_stats['bytes'] > budget:
+                _, (_, evicted_size) = _attachment_cache.popitem(last=False)
+                _attachment_cache_stats['bytes'] -= evicted_size
     
-    for i, line in enumerate(lines):
-        if line.startswith('Subject:'):
-            subject = line.replace('Subject:', '').strip()
-        elif i > 0 or not line.startswith('Subject:'):
-            body_lines.append(line)
+    return part
+
+def get_attachment_cache_stats():
+    """
+    Return hit/miss counters and current size of the attachment cache.
+    """
+    with _attachment_cache_lock:
+        return dict(_attachment_cache_stats, entries=len(_attachment_cache))
+
+def build_message(to_email, subject, body, resume_path=None):
+    """
+    Build the MIME message for one recipient, with the resume attached if provided.
+    """
+    message = MIMEMultipart()
+    message['to'] = to_email
+    message['subject'] = subject
+    
+    # Add body
+    message.attach(MIMEText(body, 'plain'))
     
-    body = '\n'.join(body_lines).strip()
+    # Attach resume if provided
+    if resume_path and os.path.exists(resume_path):
+        message.attach(get_attachment_part(resume_path))
     
-    return subject, body
+    return message
+
+def send_email(to_email, subject, body, resume_path=None, transport=None):
+    """
+    Send email through the configured mail transport (Config.MAIL_TRANSPORT).
+    Returns (success: bool, error_message: str or None)
+    """
+    from app.utils.mail_transport import get_transport
+    
+    try:
+        with timed('mime'):
+            message = build_message(to_email, subject, body, resume_path)
+    except Exception as e:
+        return False, f"Error sending email: {str(e)}"
+    
+    mail_transport = get_transport(transport)
+    with timed('transport', transport=mail_transport.name):
+        return mail_transport.send(message)
+
+def send_email_via_gmail(to_email, subject, body, resume_path=None):
+    """
+    Send email using Gmail API.
+    Returns (success: bool, error_message: str or None)
+    """
+    return send_email(to_email, subject, body, resume_path, transport='gmail')
+
+def prepare_email_content(template, company_data):
+    """
+    Replace placeholders in email template with company data.
+    Returns (subject, body). The template is compiled once and cached.
+    """
+    with timed('render'):
+        return compile_template(template, strict=False).render(company_data)
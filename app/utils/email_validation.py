@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email_validator import validate_email, EmailNotValidError, EmailUndeliverableError
+from config import Config
+
+# Per-process cache of domain deliverability results:
+# ascii domain -> (error message or None, expires at)
+_domain_cache = {}
+_domain_cache_lock = threading.Lock()
+
+def _lookup_domain(domain):
+    """
+    Resolve one domain's MX/A records. Returns an error message or None.
+    """
+    from email_validator.deliverability import validate_email_deliverability
+    
+    try:
+        validate_email_deliverability(domain, domain)
+        return None
+    except EmailUndeliverableError as e:
+        return str(e)
+
+def _cached_result(domain, now):
+    entry = _domain_cache.get(domain)
+    if entry is not None and entry[1] > now:
+        return entry
+    return None
+
+def check_domains(domains):
+    """
+    Make sure deliverability results for all `domains` are cached, resolving
+    the uncached ones concurrently. Returns {domain: error message or None}.
+    """
+    now = time.monotonic()
+    with _domain_cache_lock:
+        results = {}
+        missing = []
+        for domain in set(domains):
+            entry = _cached_result(domain, now)
+            if entry is None:
+                missing.append(domain)
+            else:
+                results[domain] = entry[0]
+    
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(Config.EMAIL_DNS_WORKERS, len(missing))) as pool:
+            resolved = dict(zip(missing, pool.map(_lookup_domain, missing)))
+        
+        expires_at = time.monotonic() + Config.EMAIL_DOMAIN_CACHE_TTL
+        with _domain_cache_lock:
+            for domain, error in resolved.items():
+                _domain_cache[domain] = (error, expires_at)
+        results.update(resolved)
+    
+    return results
+
+def check_syntax(email):
+    """
+    Offline syntax check and normalization of an address.
+    Raises EmailNotValidError; returns the ValidatedEmail.
+    """
+    return validate_email(email, check_deliverability=False)
+
+def validate_addresses(emails):
+    """
+    Validate a batch of addresses. Syntax is checked per address, but DNS is
+    only queried once per distinct domain (and cached across batches), so the
+    cost scales with the number of domains rather than rows.
+    Set EMAIL_VALIDATION_MODE=syntax to skip DNS entirely.
+    Returns a list of (normalized email or None, error message or None).
+    """
+    results = []
+    for email in emails:
+        try:
+            validated = check_syntax(email)
+            results.append((validated.normalized, validated.ascii_domain, None))
+        except EmailNotValidError as e:
+            results.append((None, None, str(e)))
+    
+    if Config.EMAIL_VALIDATION_MODE == 'syntax':
+        return [(email, error) for email, _, error in results]
+    
+    domain_errors = check_domains(domain for _, domain, _ in results if domain)
+    return [
+        (None, domain_errors[domain]) if domain and domain_errors.get(domain) else (email, error)
+        for email, domain, error in results
+    ]
+
+def clear_domain_cache():
+    with _domain_cache_lock:
+        _domain_cache.clear()
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+import uuid
+import redis
+from config import Config
+
+_redis = None
+_redis_lock = threading.Lock()
+
+def get_redis():
+    """
+    Per-process Redis client for REDIS_URL (connections are pooled by redis-py).
+    """
+    global _redis
+    with _redis_lock:
+        if _redis is None:
+            _redis = redis.Redis.from_url(Config.REDIS_URL)
+        return _redis
+
+def campaign_channel(campaign_id):
+    return f'campaign:{campaign_id}:events'
+
+def campaign_version_key(campaign_id):
+    # Hash of the event count and the epoch it counts from
+    return f'campaign:{campaign_id}:etag'
+
+def campaign_status_key(campaign_id):
+    return f'campaign:{campaign_id}:status'
+
+# Events that are campaign status changes; publishing one also records the
+# new status in Redis, where the send tasks read it instead of the database
+CAMPAIGN_STATUSES = {'draft', 'importing', 'scheduled', 'active', 'paused', 'completed'}
+
+def publish_campaign_event(campaign_id, event, **data):
+    """
+    Publish a progress event (sent, failed, paused, completed, ...) for a
+    campaign and bump its version, which the status API uses as its ETag.
+    Status events also update the campaign's status signal. Redis being
+    unavailable never interrupts sending.
+    """
+    payload = json.dumps({'event': event, 'campaign_id': campaign_id, **data})
+    try:
+        pipe = get_redis().pipeline()
+        if event in CAMPAIGN_STATUSES:
+            pipe.set(campaign_status_key(campaign_id), event, ex=Config.CAMPAIGN_STATUS_TTL)
+        pipe.hsetnx(campaign_version_key(campaign_id), 'epoch', uuid.uuid4().hex[:12])
+        pipe.hincrby(campaign_version_key(campaign_id), 'count', 1)
+        pipe.publish(campaign_channel(campaign_id), payload)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+def set_campaign_status(campaign_id, status):
+    """
+    Record a campaign's new status in its status signal. Unlike
+    publish_campaign_event this raises RedisError, for status changes that
+    must not be lost: a failed pause would otherwise leave the send tasks
+    reading 'active' until the signal expires.
+    """
+    get_redis().set(campaign_status_key(campaign_id), status, ex=Config.CAMPAIGN_STATUS_TTL)
+
+def get_campaign_version(campaign_id):
+    """
+    Current event version of a campaign, as '<epoch>-<count>', or None if
+    Redis is unavailable. The epoch is picked at random whenever the version
+    is created, so a version lost to eviction or a flush never comes back
+    with a number a client has already seen.
+    """
+    key = campaign_version_key(campaign_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hsetnx(key, 'epoch', uuid.uuid4().hex[:12])
+        pipe.hmget(key, 'epoch', 'count')
+        _, (epoch, count) = pipe.execute()
+    except redis.RedisError:
+        return None
+    return f'{epoch.decode()}-{int(count or 0)}'
+
+def get_campaign_statuses(campaign_ids):
+    """
+    Statuses of campaigns from their status signals, in one round trip:
+    None for a campaign whose signal is missing (expired, or set before
+    it was introduced), to be read from the database instead.
+    """
+    if not campaign_ids:
+        return []
+    values = get_redis().mget([campaign_status_key(campaign_id) for campaign_id in campaign_ids])
+    return [value.decode() if value else None for value in values]
+
+def seed_campaign_status(campaign_id, status):
+    """
+    Fill in a missing status signal from the database. Never overwrites one,
+    which a status change published meanwhile may have set.
+    """
+    get_redis().set(campaign_status_key(campaign_id), status, ex=Config.CAMPAIGN_STATUS_TTL, nx=True)
+
+def stream_campaign_events(campaign_id):
+    """
+    Generator of Server-Sent Events for a campaign, fed by Redis pub/sub.
+    Sends a comment line every SSE_KEEPALIVE_SECONDS so proxies keep the
+    connection open.
+    """
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(campaign_channel(campaign_id))
+    try:
+        yield 'retry: 5000\n\n'
+        last_sent = time.monotonic()
+        while True:
+            message = pubsub.get_message(timeout=1.0)
+            if message is None:
+                # Subscribe confirmations also come back as None, so only
+                # send a keepalive once the connection has been quiet long enough
+                if time.monotonic() - last_sent >= Config.SSE_KEEPALIVE_SECONDS:
+                    yield ': keepalive\n\n'
+                    last_sent = time.monotonic()
+                continue
+            data = message['data'].decode('utf-8')
+            event = json.loads(data)['event']
+            yield f'event: {event}\ndata: {data}\n\n'
+            last_sent = time.monotonic()
+    finally:
+        pubsub.close()
@@ -0,0 +1,97 @@
+import csv
+import io
+import os
+from sqlalchemy import select
+from config import Config
+from app import db
+from app.models import EmailLog, ArchivedEmailLog, Company
+from app.utils.stats import STATUS_ALIASES
+
+# Header of exported campaign results
+EXPORT_HEADER = (
+    'Company Name', 'Email', 'Recipient Name', 'Role', 'Designation',
+    'Status', 'Attempts', 'Sent At', 'Error Kind', 'Error', 'Created At',
+)
+
+def iter_export_rows(campaign_id, archived=False, batch_size=None):
+    """
+    Yield lists of export rows for a campaign's email logs with their
+    companies, in log order. Rows are fetched `batch_size`
+    (Config.EXPORT_BATCH_SIZE) at a time through a server-side cursor, so
+    memory use doesn't depend on the campaign size.
+    """
+    batch_size = batch_size or Config.EXPORT_BATCH_SIZE
+    model = ArchivedEmailLog if archived else EmailLog
+    query = (
+        select(
+            Company.company_name, Company.recipient_email, Company.recipient_name,
+            Company.role, Company.designation, model.status, model.attempts,
+            model.sent_at, model.error_kind, model.error_message, model.created_at,
+        )
+        .join(Company, Company.id == model.company_id)
+        .where(model.campaign_id == campaign_id)
+        .order_by(model.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for partition in db.session.execute(query).partitions():
+        yield [_export_row(row) for row in partition]
+
+def _export_row(row):
+    row = list(row)
+    row[5] = STATUS_ALIASES.get(row[5], row[5])
+    return row
+
+def _format_time(value):
+    return value.isoformat(sep=' ', timespec='seconds') if value else ''
+
+def iter_export_csv(campaign_id, archived=False, batch_size=None):
+    """
+    Generator of CSV text for a campaign's results, one chunk per batch of
+    rows, for a streamed response.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    for rows in iter_export_rows(campaign_id, archived, batch_size):
+        for row in rows:
+            row[7] = _format_time(row[7])
+            row[10] = _format_time(row[10])
+            writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_path(campaign_id):
+    """
+    Where a campaign's XLSX export is written.
+    """
+    return os.path.abspath(os.path.join(Config.EXPORT_FOLDER, f'campaign_{campaign_id}.xlsx'))
+
+def write_export_xlsx(campaign_id, archived=False, batch_size=None):
+    """
+    Write a campaign's results to its XLSX export file and return the path.
+    The workbook is written in openpyxl's write-only mode, which streams rows
+    to disk, and replaces the previous export only once complete.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    
+    path = export_path(campaign_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.{os.getpid()}.tmp'
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Results')
+    sheet.append(EXPORT_HEADER)
+    for rows in iter_export_rows(campaign_id, archived, batch_size):
+        for row in rows:
+            # Control characters (e.g. from SMTP error replies) aren't valid in XLSX
+            sheet.append([ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value for value in row])
+    try:
+        workbook.save(partial)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return path
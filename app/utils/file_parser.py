@@ -1,81 +1,302 @@
-import pandas as pd
-from email_validator import validate_email, EmailNotValidError
+import re
+from config import Config
+from app.utils.email_validation import validate_addresses
+from app.utils.metrics import timed, inc
 
-def parse_companies_file(file_path):
+# Map common column name variations
+COLUMN_MAPPING = {
+    'company': 'company_name',
+    'company name': 'company_name',
+    'organization': 'company_name',
+    'email': 'email',
+    'email id': 'email',
+    'recipient email': 'email',
+    'hr email': 'email',
+    'contact email': 'email',
+    'name': 'name',
+    'recipient name': 'name',
+    'contact name': 'name',
+    'role': 'role',
+    'position': 'role',
+    'designation': 'designation',
+    'title': 'designation',
+}
+
+STANDARD_COLUMNS = {'company_name', 'email', 'name', 'role', 'designation'}
+
+class ImportReport:
+    """
+    Counts and a sample of rejected rows collected while parsing a file.
+    """
+    
+    def __init__(self, max_rejected=None):
+        self.total_rows = 0
+        self.valid = 0
+        self.missing_fields = 0
+        self.duplicates = 0
+        self.invalid_emails = 0
+        self.already_contacted = 0  # filled in by the import, not the parser
+        self.rejected = []
+        self.error = None
+        self.max_rejected = max_rejected if max_rejected is not None else Config.IMPORT_REPORT_MAX_REJECTED
+    
+    @property
+    def rejected_count(self):
+        return self.missing_fields + self.duplicates + self.invalid_emails
+    
+    def reject(self, row_number, reason, email=None):
+        if len(self.rejected) < self.max_rejected:
+            self.rejected.append({'row': row_number, 'reason': reason, 'email': email})
+    
+    def to_dict(self):
+        return {
+            'total_rows': self.total_rows,
+            'valid': self.valid,
+            'rejected': self.rejected_count,
+            'missing_fields': self.missing_fields,
+            'duplicates': self.duplicates,
+            'invalid_emails': self.invalid_emails,
+            'already_contacted': self.already_contacted,
+            'rejected_rows': self.rejected,
+            'error': self.error,
+        }
+
+def parse_companies_file(file_path, report=None):
     """
     Parse CSV or Excel file containing company information.
     Expected columns: company_name, email, name (optional), role (optional), designation (optional)
+    Any other columns are returned under 'extra' so templates can use them as
+    custom placeholders, e.g. a "Team Lead" column becomes {team_lead}.
     Returns list of dictionaries with validated and deduplicated data.
     """
+    return list(iter_companies_file(file_path, report))
+
+def iter_companies_file(file_path, report=None, chunksize=None):
+    """
+    Streaming version of parse_companies_file: reads the file in chunks and
+    yields validated, deduplicated company dicts one at a time, so memory
+    stays flat regardless of file size. Rejected rows are recorded on
+    `report` (an ImportReport) instead of being printed.
+    """
+    report = report if report is not None else ImportReport()
+    chunksize = chunksize or Config.PARSE_CHUNK_SIZE
+    
     try:
-        # Read file based on extension
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
-            return []
-        
-        # Normalize column names (lowercase, strip spaces)
-        df.columns = df.columns.str.lower().str.strip()
+        chunks = _read_chunks(file_path, chunksize)
+        if chunks is None:
+            report.error = 'Unsupported file type'
+            return
         
-        # Map common column name variations
-        column_mapping = {
-            'company': 'company_name',
-            'company name': 'company_name',
-            'organization': 'company_name',
-            'email': 'email',
-            'email id': 'email',
-            'recipient email': 'email',
-            'hr email': 'email',
-            'contact email': 'email',
-            'name': 'name',
-            'recipient name': 'name',
-            'contact name': 'name',
-            'role': 'role',
-            'position': 'role',
-            'designation': 'designation',
-            'title': 'designation',
-        }
-        
-        df.rename(columns=column_mapping, inplace=True)
-        
-        # Ensure required columns exist
-        if 'company_name' not in df.columns or 'email' not in df.columns:
-            return []
-        
-        # Fill optional columns with empty strings
-        for col in ['name', 'role', 'designation']:
-            if col not in df.columns:
-                df[col] = ''
-        
-        # Remove rows with missing required fields
-        df = df.dropna(subset=['company_name', 'email'])
-        
-        # Remove duplicates based on email
-        df = df.drop_duplicates(subset=['email'], keep='first')
+        seen = set()
+        columns = None
+        chunks = iter(chunks)
+        while True:
+            with timed('parse_read'):
+                df = next(chunks, None)
+            if df is None:
+                break
+            if columns is None:
+                columns = _normalize_columns(df.columns)
+                if 'company_name' not in columns or 'email' not in columns:
+                    report.error = 'Missing required columns: company_name and email'
+                    return
+                extra_columns = extra_field_names(columns)
+            
+            df.columns = columns
+            with timed('parse_chunk'):
+                rows = list(_process_chunk(df, extra_columns, seen, report))
+            inc('rows_parsed_total', len(df))
+            yield from rows
+    
+    except Exception as e:
+        report.error = f"Error parsing file: {e}"
+
+def read_extra_fields(file_path):
+    """
+    Read only the header row and return the custom placeholder names the
+    file provides (an empty list if it has none), or None if the file is
+    unreadable or lacks required columns.
+    """
+    try:
+        header = _read_header(file_path)
+        if header is None:
+            return None
+        columns = _normalize_columns(header)
+        if 'company_name' not in columns or 'email' not in columns:
+            return None
+        return list(extra_field_names(columns).values())
+    except Exception:
+        return None
+
+def _read_header(file_path):
+    """
+    The header row of a companies file, named as _read_chunks names the
+    columns, without reading any data rows. None for unsupported files.
+    """
+    import pandas as pd
+    
+    if file_path.endswith('.csv'):
+        return list(pd.read_csv(file_path, nrows=0, dtype=str).columns)
+    if file_path.endswith('.xlsx'):
+        from openpyxl import load_workbook
         
-        # Validate emails and filter
-        valid_companies = []
-        for _, row in df.iterrows():
-            try:
-                # Validate email
-                validated = validate_email(row['email'])
-                
-                company_data = {
-                    'company_name': str(row['company_name']).strip(),
-                    'email': validated.email,
-                    'name': str(row.get('name', '')).strip(),
-                    'role': str(row.get('role', '')).strip(),
-                    'designation': str(row.get('designation', '')).strip(),
-                }
-                valid_companies.append(company_data)
-            except EmailNotValidError:
-                # Skip invalid emails
-                continue
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            header = next(workbook.active.iter_rows(max_row=1, values_only=True), None)
+        finally:
+            workbook.close()
+        return _unique_header(header) if header is not None else None
+    if file_path.endswith('.xls'):
+        return list(pd.read_excel(file_path, nrows=0, dtype=str).columns)
+    return None
+
+def _read_chunks(file_path, chunksize):
+    """
+    Return an iterator of DataFrames of at most `chunksize` rows, all values as strings.
+    Row index is the 0-based data row number across the whole file.
+    """
+    # pandas is only needed by the import task, keep it out of web startup
+    import pandas as pd
+    
+    if file_path.endswith('.csv'):
+        return pd.read_csv(file_path, chunksize=chunksize, dtype=str)
+    if file_path.endswith('.xlsx'):
+        return _read_xlsx_chunks(file_path, chunksize)
+    if file_path.endswith('.xls'):
+        # Legacy .xls has no streaming reader, load it and slice
+        df = pd.read_excel(file_path, dtype=str)
+        return (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+    return None
+
+def _read_xlsx_chunks(file_path, chunksize):
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = _unique_header(header)
         
-        return valid_companies
+        buffer = []
+        start = 0
+        for row in rows:
+            buffer.append(['' if value is None else str(value) for value in row[:len(header)]])
+            if len(buffer) >= chunksize:
+                yield _xlsx_frame(buffer, header, start)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _xlsx_frame(buffer, header, start)
+    finally:
+        workbook.close()
+
+def _unique_header(header):
+    """
+    Header names made unique the way pandas does for CSV: blank cells become
+    'Unnamed: <position>' and repeats of a name get '.1', '.2', ... appended.
+    """
+    names = []
+    for position, value in enumerate(header):
+        name = '' if value is None else str(value)
+        names.append(name if name.strip() else f'Unnamed: {position}')
     
-    except Exception as e:
-        print(f"Error parsing file: {e}")
-        return []
+    seen = set(names)
+    counts = {}
+    unique = []
+    for name in names:
+        if name in counts:
+            candidate = name
+            while candidate in seen:
+                counts[name] += 1
+                candidate = f'{name}.{counts[name]}'
+            seen.add(candidate)
+            unique.append(candidate)
+        else:
+            counts[name] = 0
+            unique.append(name)
+    return unique
+
+def _xlsx_frame(rows, header, start):
+    import pandas as pd
+    
+    df = pd.DataFrame(rows, columns=header, index=range(start, start + len(rows)))
+    # Blank cells behave like missing values in CSV input
+    return df.replace('', None)
+
+def _normalize_columns(columns):
+    """
+    Normalized column names (lowercase, stripped, aliases applied), in the
+    same order as the raw ones.
+    """
+    normalized = []
+    for column in columns:
+        name = str(column).lower().strip()
+        normalized.append(COLUMN_MAPPING.get(name, name))
+    return normalized
+
+def _process_chunk(df, extra_columns, seen, report):
+    """
+    Clean one chunk with vectorized pandas operations, then validate and
+    yield the surviving rows.
+    """
+    report.total_rows += len(df)
+    
+    # Keep the first of any duplicated normalized column
+    df = df.loc[:, ~df.columns.duplicated()].copy()
+    
+    # Fill optional columns with empty strings
+    for col in ['name', 'role', 'designation']:
+        if col not in df.columns:
+            df[col] = ''
+    text_columns = list(STANDARD_COLUMNS) + list(extra_columns)
+    df[text_columns] = df[text_columns].fillna('').apply(lambda column: column.str.strip())
+    
+    # Rows missing a company name or email
+    missing = (df['company_name'] == '') | (df['email'] == '')
+    for row_number in df.index[missing]:
+        report.reject(row_number + 2, 'missing company_name or email')
+    report.missing_fields += int(missing.sum())
+    df = df[~missing]
+    
+    # Dedup on lowercased email, within the chunk and against earlier chunks
+    keys = df['email'].str.lower()
+    duplicate = keys.duplicated(keep='first') | keys.isin(seen)
+    for row_number, email in zip(df.index[duplicate], df['email'][duplicate]):
+        report.reject(row_number + 2, 'duplicate email', email)
+    report.duplicates += int(duplicate.sum())
+    df = df[~duplicate]
+    seen.update(keys[~duplicate])
+    
+    # Validate emails, resolving each distinct domain once
+    validated = validate_addresses(df['email'].tolist())
+    
+    for row_number, row, (email, error) in zip(df.index, df.to_dict('records'), validated):
+        if error:
+            report.invalid_emails += 1
+            report.reject(row_number + 2, f'invalid email: {error}', row['email'])
+            continue
+        
+        report.valid += 1
+        yield {
+            'company_name': row['company_name'],
+            'email': email,
+            'name': row['name'],
+            'role': row['role'],
+            'designation': row['designation'],
+            'extra': {field: row[column] for column, field in extra_columns.items()},
+        }
+
+def extra_field_names(columns):
+    """
+    Map non-standard column names to placeholder names usable in templates.
+    """
+    fields = {}
+    for column in columns:
+        if column in STANDARD_COLUMNS:
+            continue
+        field = re.sub(r'\W+', '_', str(column)).strip('_')
+        if field and not field[0].isdigit():
+            fields[column] = field
+    return fields
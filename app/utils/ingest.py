@@ -0,0 +1,83 @@
+import time
+from datetime import datetime
+from itertools import islice
+from config import Config
+from app.utils.metrics import timed, inc
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def ingest_companies(campaign_id, user_id, companies_data, batch_size=None, progress=None, exclude=None):
+    """
+    Insert companies and their pending email logs for a campaign in batches.
+    Each batch is one multi-row INSERT ... RETURNING for the companies and one
+    executemany for the email logs, linked by the returned company IDs.
+    Accepts any iterable of parsed company dicts (see parse_companies_file).
+    If given, progress(inserted) is called after every batch, and companies
+    whose email is in `exclude` (a ContactedIndex) are skipped in bulk.
+    Does not commit; returns {'inserted', 'skipped', 'seconds', 'rows_per_second'}.
+    """
+    from sqlalchemy import insert
+    from app import db
+    from app.models import Company, EmailLog
+    
+    batch_size = batch_size or Config.INGEST_BATCH_SIZE
+    company_insert = insert(Company.__table__).returning(
+        Company.__table__.c.id, sort_by_parameter_order=True
+    )
+    log_insert = insert(EmailLog.__table__)
+    
+    inserted = 0
+    started = time.perf_counter()
+    
+    for batch in _batches(companies_data, batch_size):
+        if exclude is not None:
+            with timed('ingest_exclude'):
+                batch = exclude.filter_new(batch)
+            if not batch:
+                continue
+        now = datetime.utcnow()
+        company_rows = [
+            {
+                'campaign_id': campaign_id,
+                'company_name': company_data.get('company_name', ''),
+                'recipient_email': company_data.get('email', ''),
+                'recipient_name': company_data.get('name', ''),
+                'role': company_data.get('role', ''),
+                'designation': company_data.get('designation', ''),
+                'extra_fields': company_data.get('extra') or None,
+                'created_at': now,
+            }
+            for company_data in batch
+        ]
+        with timed('ingest_insert'):
+            company_ids = db.session.execute(company_insert, company_rows).scalars().all()
+            
+            db.session.execute(log_insert, [
+                {
+                    'campaign_id': campaign_id,
+                    'company_id': company_id,
+                    'user_id': user_id,
+                    'status': 'pending',
+                    'created_at': now,
+                }
+                for company_id in company_ids
+            ])
+        inc('rows_ingested_total', len(company_ids))
+        inserted += len(company_ids)
+        
+        if progress:
+            progress(inserted)
+    
+    seconds = time.perf_counter() - started
+    return {
+        'inserted': inserted,
+        'skipped': exclude.skipped if exclude is not None else 0,
+        'seconds': seconds,
+        'rows_per_second': inserted / seconds if seconds else 0.0,
+    }
@@ -0,0 +1,264 @@
+import base64
+import re
+import smtplib
+import socket
+import threading
+from collections import deque
+from google.auth.exceptions import TransportError
+from googleapiclient.errors import HttpError
+from config import Config
+from app.utils.email_sender import get_cached_gmail_service
+from app.utils.metrics import timed
+
+# How a failed send should be handled
+TRANSIENT = 'transient'  # network hiccup or server error: retry this email later
+QUOTA = 'quota'          # rate or quota limit hit: back off all of the user's sending
+PERMANENT = 'permanent'  # bad address, rejected message: don't retry
+
+# Gmail reports some quota errors as 403 with one of these reasons
+GMAIL_QUOTA_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'dailyLimitExceeded', 'quotaExceeded'}
+
+class SendFailure(str):
+    """
+    Error message for a failed send, tagged with its kind (TRANSIENT, QUOTA
+    or PERMANENT) and the server's Retry-After in seconds, if any. It is a
+    str so it can be stored as the email log's error_message as is.
+    """
+    
+    def __new__(cls, message, kind=PERMANENT, retry_after=None):
+        failure = super().__new__(cls, message)
+        failure.kind = kind
+        failure.retry_after = retry_after
+        return failure
+
+def failure_kind(error):
+    """
+    Kind of a transport error message; plain strings count as permanent.
+    """
+    return getattr(error, 'kind', PERMANENT)
+
+def _retry_after(headers):
+    try:
+        return int(headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def classify_http_error(error):
+    """
+    SendFailure for a Gmail API HttpError: 429 and quota 403s are QUOTA,
+    5xx are TRANSIENT, anything else PERMANENT.
+    """
+    status = getattr(error.resp, 'status', None)
+    reasons = {detail.get('reason') for detail in (error.error_details or []) if isinstance(detail, dict)}
+    if status == 429 or (status == 403 and reasons & GMAIL_QUOTA_REASONS):
+        kind = QUOTA
+    elif status is not None and status >= 500:
+        kind = TRANSIENT
+    else:
+        kind = PERMANENT
+    return SendFailure(f"Gmail API error: {error}", kind, _retry_after(error.resp))
+
+# Enhanced status code (RFC 3463) in an SMTP reply, e.g. 4.2.2
+ENHANCED_CODE_RE = re.compile(r'\b([245])\.(\d{1,3})\.(\d{1,3})\b')
+
+def classify_smtp_error(error):
+    """
+    SendFailure for an SMTP exception: dropped connections and 4xx replies
+    are TRANSIENT (QUOTA if the server says the sender is over a limit), 5xx
+    replies PERMANENT. Replies about the recipient (refused recipients,
+    address and mailbox statuses X.1.x / X.2.x, such as a full mailbox)
+    only concern that email and are never QUOTA.
+    """
+    code = getattr(error, 'smtp_code', None)
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        code = max(reply[0] for reply in error.recipients.values())
+    text = str(error).lower()
+    enhanced = ENHANCED_CODE_RE.search(text)
+    recipient_level = isinstance(error, smtplib.SMTPRecipientsRefused) or (
+        enhanced is not None and enhanced.group(2) in ('1', '2')
+    )
+    
+    if recipient_level:
+        temporary = (code is not None and 400 <= code < 500) or (enhanced is not None and enhanced.group(1) == '4')
+        kind = TRANSIENT if temporary else PERMANENT
+    # e.g. Gmail's 550 5.4.5 "Daily user sending quota exceeded"
+    elif any(marker in text for marker in ('quota', 'rate limit', 'too many', '5.4.5')):
+        kind = QUOTA
+    elif isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        kind = TRANSIENT
+    elif code is not None and 400 <= code < 500:
+        kind = TRANSIENT
+    else:
+        kind = PERMANENT
+    return SendFailure(f"SMTP error: {error}", kind)
+
+def classify_exception(e):
+    """
+    SendFailure for any other exception: network errors are TRANSIENT.
+    """
+    if isinstance(e, (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, TransportError)):
+        kind = TRANSIENT
+    else:
+        kind = PERMANENT
+    return SendFailure(f"Error sending email: {str(e)}", kind)
+
+class MailTransport:
+    """
+    Base class for mail transports. Subclasses implement send(); send_many()
+    falls back to one send per message unless the backend can do better.
+    """
+    name = None
+    
+    def send(self, message):
+        """
+        Send a single MIME message.
+        Returns (success: bool, error_message: SendFailure or None)
+        """
+        raise NotImplementedError
+    
+    def send_many(self, messages):
+        """
+        Send several MIME messages.
+        Returns a list of (success, error_message) in the same order.
+        """
+        return [self.send(message) for message in messages]
+    
+    def close(self):
+        pass
+
+class GmailApiTransport(MailTransport):
+    """
+    One Gmail API request per message.
+    """
+    name = 'gmail'
+    
+    @staticmethod
+    def encode(message):
+        with timed('encode'):
+            return base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    
+    def send(self, message):
+        try:
+            service = get_cached_gmail_service()
+            request = service.users().messages().send(
+                userId='me',
+                body={'raw': self.encode(message)}
+            )
+            with timed('gmail_api'):
+                request.execute()
+            return True, None
+        except HttpError as error:
+            return False, classify_http_error(error)
+        except Exception as e:
+            return False, classify_exception(e)
+
+class SmtpTransport(MailTransport):
+    """
+    Plain SMTP over a persistent connection that is reused across sends and
+    reopened if the server drops it. Also works against a local stand-in
+    such as `python -m aiosmtpd -n -l localhost:1025` for load tests.
+    Messages go out from MAIL_FROM, or the SMTP username if it is empty.
+    """
+    name = 'smtp'
+    
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None, sender=None):
+        self.host = host or Config.SMTP_HOST
+        self.port = port or Config.SMTP_PORT
+        self.username = username if username is not None else Config.SMTP_USERNAME
+        self.password = password if password is not None else Config.SMTP_PASSWORD
+        self.use_tls = Config.SMTP_USE_TLS if use_tls is None else use_tls
+        self.sender = sender or Config.MAIL_FROM or self.username
+        if not self.sender:
+            # Most relays reject messages without a From header
+            raise ValueError("SMTP transport needs MAIL_FROM or SMTP_USERNAME to send from")
+        self._connection = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.use_tls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+    
+    def _send_locked(self, message):
+        if not message['from']:
+            message['from'] = self.sender
+        
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.send_message(message)
+                return True, None
+            except smtplib.SMTPServerDisconnected:
+                # Stale pooled connection, reconnect once
+                self._connection = None
+                if attempt:
+                    raise
+    
+    def send(self, message):
+        return self.send_many([message])[0]
+    
+    def send_many(self, messages):
+        results = []
+        with self._lock:
+            for message in messages:
+                try:
+                    results.append(self._send_locked(message))
+                except smtplib.SMTPException as error:
+                    results.append((False, classify_smtp_error(error)))
+                except Exception as e:
+                    results.append((False, classify_exception(e)))
+        return results
+    
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.quit()
+                except smtplib.SMTPException:
+                    pass
+                self._connection = None
+
+class FakeTransport(MailTransport):
+    """
+    Counts messages instead of delivering them. The last `keep`
+    (Config.FAKE_OUTBOX_SIZE, none by default) are kept in `outbox` for
+    inspection.
+    """
+    name = 'fake'
+    
+    def __init__(self, keep=None):
+        self.outbox = deque(maxlen=Config.FAKE_OUTBOX_SIZE if keep is None else keep)
+        self.sent = 0
+        self._lock = threading.Lock()
+    
+    def send(self, message):
+        with self._lock:
+            self.outbox.append(message)
+            self.sent += 1
+        return True, None
+
+TRANSPORTS = {
+    transport.name: transport
+    for transport in (GmailApiTransport, SmtpTransport, FakeTransport)
+}
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+def get_transport(name=None):
+    """
+    Return the per-process transport instance for `name`, defaulting to
+    Config.MAIL_TRANSPORT.
+    """
+    name = name or Config.MAIL_TRANSPORT
+    
+    with _transports_lock:
+        if name not in _transports:
+            if name not in TRANSPORTS:
+                raise ValueError(f"Unknown mail transport: {name}")
+            _transports[name] = TRANSPORTS[name]()
+        return _transports[name]
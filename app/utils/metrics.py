@@ -0,0 +1,245 @@
+import threading
+import time
+from contextvars import ContextVar
+from config import Config
+
+# Upper bounds of the timing histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = 'applyflow_'
+
+# Help text for the metrics written by the app
+HELP = {
+    'stage_seconds': 'Time spent in each hot-path stage',
+    'rate_limit_wait_seconds': 'Wait imposed by the rate limiter on a refused send',
+    'emails_total': 'Send attempts by result',
+    'rate_limited_total': 'Sends refused by the rate limiter, by reason',
+    'rows_parsed_total': 'Rows read from companies files',
+    'rows_ingested_total': 'Companies inserted by imports',
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}    # (name, labels) -> value
+
+# Campaign the current task works on, and its stage timings not yet flushed
+_campaign = ContextVar('metrics_campaign', default=None)
+_campaign_timings = ContextVar('metrics_campaign_timings', default=None)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    """
+    Record one observation in histogram `name`.
+    """
+    if not Config.METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+                break
+        else:
+            histogram[len(BUCKETS)] += 1
+        histogram[-1] += seconds
+
+def inc(name, amount=1, **labels):
+    """
+    Add `amount` to counter `name`.
+    """
+    if not Config.METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+class _Timer:
+    __slots__ = ('stage', 'labels', 'started')
+    
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        observe('stage_seconds', seconds, stage=self.stage, **self.labels)
+        timings = _campaign_timings.get()
+        if timings is not None:
+            entry = timings.setdefault(self.stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        return False
+
+class _NoopTimer:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP = _NoopTimer()
+
+def timed(stage, **labels):
+    """
+    Context manager timing a stage into the stage_seconds histogram, and
+    into the bound campaign's breakdown if there is one. A shared no-op
+    when metrics are disabled.
+    """
+    if not Config.METRICS_ENABLED:
+        return _NOOP
+    return _Timer(stage, labels)
+
+def campaign_timings_key(campaign_id):
+    return f'metrics:campaign:{campaign_id}'
+
+def bind_campaign(campaign_id):
+    """
+    Attribute the stages timed from now on to a campaign, until
+    flush_campaign_timings() is called at the end of the task.
+    """
+    if not Config.METRICS_ENABLED:
+        return
+    _campaign.set(campaign_id)
+    _campaign_timings.set({})
+
+def flush_campaign_timings():
+    """
+    Add the bound campaign's stage timings to its totals in Redis (one
+    round trip) and unbind it.
+    """
+    campaign_id = _campaign.get()
+    timings = _campaign_timings.get()
+    _campaign.set(None)
+    _campaign_timings.set(None)
+    if campaign_id is None or not timings:
+        return
+    
+    from redis import RedisError
+    from app.utils.events import get_redis
+    
+    key = campaign_timings_key(campaign_id)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for stage, (count, seconds) in timings.items():
+            pipe.hincrby(key, f'{stage}:count', count)
+            pipe.hincrbyfloat(key, f'{stage}:seconds', seconds)
+        pipe.expire(key, Config.METRICS_CAMPAIGN_TTL)
+        pipe.execute()
+    except RedisError:
+        pass
+
+def get_campaign_timings(campaign_id):
+    """
+    Per-stage timing breakdown of a campaign, summed over all workers:
+    {stage: {'count', 'seconds', 'mean_seconds'}}, slowest stage first.
+    """
+    from app.utils.events import get_redis
+    
+    raw = get_redis().hgetall(campaign_timings_key(campaign_id))
+    stages = {}
+    for field, value in raw.items():
+        stage, kind = field.decode().rsplit(':', 1)
+        stages.setdefault(stage, {'count': 0, 'seconds': 0.0})[kind] = float(value) if kind == 'seconds' else int(value)
+    for entry in stages.values():
+        entry['mean_seconds'] = entry['seconds'] / entry['count'] if entry['count'] else 0.0
+    return dict(sorted(stages.items(), key=lambda item: item[1]['seconds'], reverse=True))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def render_metrics():
+    """
+    This process's metrics in the Prometheus text exposition format.
+    """
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        counters = dict(_counters)
+    
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        metric = PREFIX + name
+        lines.append(f'# HELP {metric} {HELP.get(name, name)}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (key_name, labels), values in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            cumulative += values[len(BUCKETS)]
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {values[-1]}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {cumulative}')
+    
+    for name in sorted({name for name, _ in counters}):
+        metric = PREFIX + name
+        lines.append(f'# HELP {metric} {HELP.get(name, name)}')
+        lines.append(f'# TYPE {metric} counter')
+        for (key_name, labels), value in sorted(counters.items()):
+            if key_name == name:
+                lines.append(f'{metric}{_format_labels(labels)} {value}')
+    
+    return '\n'.join(lines) + '\n'
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def start_exporter(port=None, tries=None):
+    """
+    Serve render_metrics() over HTTP from a daemon thread, for worker
+    processes that have no Flask server. Binds the first free port from
+    `port` (Config.METRICS_WORKER_PORT) on, so each pool process gets its
+    own. Returns the port, or None if disabled or no port was free.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    if not Config.METRICS_ENABLED:
+        return None
+    port = port if port is not None else Config.METRICS_WORKER_PORT
+    tries = tries if tries is not None else Config.METRICS_WORKER_PORT_RANGE
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    for candidate in range(port, port + tries):
+        try:
+            server = ThreadingHTTPServer(('0.0.0.0', candidate), Handler)
+        except OSError:
+            continue
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True).start()
+        return candidate
+    return None
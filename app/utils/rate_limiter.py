@@ -0,0 +1,194 @@
+import random
+from collections import namedtuple
+from datetime import datetime
+from config import Config
+from app.utils.events import get_redis
+
+# Both scripts run atomically inside Redis, so concurrent campaigns of the
+# same user can't overshoot the limits. Time comes from the Redis server so
+# all workers share one clock.
+#
+# Per-user hash fields: hour_start, hour_count, day_start, day_count, next_allowed
+# Each window is a bucket of MAX_EMAILS_PER_HOUR/DAY tokens that refills when
+# the window rolls over; next_allowed enforces the random gap between emails.
+ACQUIRE_SCRIPT = """
+local key = KEYS[1]
+local max_hour = tonumber(ARGV[1])
+local max_day = tonumber(ARGV[2])
+local delay = tonumber(ARGV[3])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local state = redis.call('HMGET', key, 'hour_start', 'hour_count', 'day_start', 'day_count', 'next_allowed')
+local hour_start = tonumber(state[1]) or now
+local hour_count = tonumber(state[2]) or 0
+local day_start = tonumber(state[3]) or now
+local day_count = tonumber(state[4]) or 0
+local next_allowed = tonumber(state[5]) or 0
+
+if now - hour_start >= 3600 then
+    hour_start = now
+    hour_count = 0
+end
+if now - day_start >= 86400 then
+    day_start = now
+    day_count = 0
+end
+
+local allowed = 0
+local reason = 'ok'
+local retry_at = now
+if day_count >= max_day then
+    reason = 'day'
+    retry_at = day_start + 86400
+elseif hour_count >= max_hour then
+    reason = 'hour'
+    retry_at = hour_start + 3600
+elseif now < next_allowed then
+    reason = 'delay'
+    retry_at = next_allowed
+else
+    allowed = 1
+    hour_count = hour_count + 1
+    day_count = day_count + 1
+    next_allowed = now + delay
+    retry_at = next_allowed
+end
+
+redis.call('HSET', key, 'hour_start', tostring(hour_start), 'hour_count', hour_count,
+    'day_start', tostring(day_start), 'day_count', day_count, 'next_allowed', tostring(next_allowed))
+redis.call('EXPIRE', key, 172800)
+
+return {allowed, reason, tostring(retry_at), tostring(now), hour_count, day_count,
+    tostring(hour_start), tostring(day_start)}
+"""
+
+# Give back a token taken by acquire_send_slot when nothing was sent
+RELEASE_SCRIPT = """
+local key = KEYS[1]
+for _, field in ipairs({'hour_count', 'day_count'}) do
+    local count = tonumber(redis.call('HGET', key, field))
+    if count and count > 0 then
+        redis.call('HINCRBY', key, field, -1)
+    end
+end
+redis.call('HSET', key, 'next_allowed', '0')
+return 1
+"""
+
+# Push the user's next allowed send back after a quota error. Consecutive
+# quota errors (within twice the maximum backoff) double the wait.
+DEFER_SCRIPT = """
+local key = KEYS[1]
+local strikes_key = KEYS[2]
+local base = tonumber(ARGV[1])
+local cap = tonumber(ARGV[2])
+local jitter = tonumber(ARGV[3])
+local retry_after = tonumber(ARGV[4])
+
+local strikes = redis.call('INCR', strikes_key)
+redis.call('EXPIRE', strikes_key, cap * 2)
+
+local wait = math.min(cap, base * 2 ^ (strikes - 1))
+wait = wait / 2 + wait / 2 * jitter
+if retry_after > wait then
+    wait = retry_after
+end
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local next_allowed = math.max(tonumber(redis.call('HGET', key, 'next_allowed')) or 0, now + wait)
+redis.call('HSET', key, 'next_allowed', tostring(next_allowed))
+redis.call('EXPIRE', key, 172800)
+return {tostring(next_allowed), tostring(now), strikes}
+"""
+
+RateLimitDecision = namedtuple('RateLimitDecision', [
+    'allowed',          # True if an email may be sent now (a token was taken)
+    'reason',           # 'ok', 'hour', 'day' or 'delay'
+    'retry_at',         # datetime of the next allowed send
+    'now',              # Redis server time of the decision
+    'emails_this_hour',
+    'emails_today',
+    'hour_start',
+    'day_start',
+])
+
+_scripts = {}
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = get_redis().register_script(source)
+    return _scripts[name]
+
+def rate_limit_key(user_id):
+    return f'ratelimit:{user_id}'
+
+def quota_strikes_key(user_id):
+    return f'ratelimit:{user_id}:quota'
+
+def _timestamp(value):
+    return datetime.utcfromtimestamp(float(value))
+
+def acquire_send_slot(user_id, delay=None):
+    """
+    Atomically check the user's hourly/daily limits and gap between emails,
+    and take a token if an email may be sent now. One Redis round trip.
+    `delay` is the gap before the following email, random between
+    MIN_DELAY_SECONDS and MAX_DELAY_SECONDS by default.
+    """
+    if delay is None:
+        delay = random.randint(Config.MIN_DELAY_SECONDS, Config.MAX_DELAY_SECONDS)
+    
+    result = _script('acquire', ACQUIRE_SCRIPT)(
+        keys=[rate_limit_key(user_id)],
+        args=[Config.MAX_EMAILS_PER_HOUR, Config.MAX_EMAILS_PER_DAY, delay]
+    )
+    allowed, reason, retry_at, now, hour_count, day_count, hour_start, day_start = result
+    return RateLimitDecision(
+        allowed=bool(allowed),
+        reason=reason.decode() if isinstance(reason, bytes) else reason,
+        retry_at=_timestamp(retry_at),
+        now=_timestamp(now),
+        emails_this_hour=int(hour_count),
+        emails_today=int(day_count),
+        hour_start=_timestamp(hour_start),
+        day_start=_timestamp(day_start),
+    )
+
+def release_send_slot(user_id):
+    """
+    Return the token taken by acquire_send_slot, e.g. when the send failed
+    or there was nothing left to send, and drop the gap before the next one.
+    """
+    _script('release', RELEASE_SCRIPT)(keys=[rate_limit_key(user_id)])
+
+def seconds_until(decision):
+    """
+    Whole seconds from the decision until its retry time (at least 1).
+    """
+    return max(1, int((decision.retry_at - decision.now).total_seconds()) + 1)
+
+def defer_user_sends(user_id, retry_after=None):
+    """
+    Back off all of a user's sending after a quota error, for a jittered
+    exponential wait that grows with consecutive quota errors (or the
+    server's Retry-After, if longer). Returns the seconds until the next
+    allowed send.
+    """
+    next_allowed, now, _ = _script('defer', DEFER_SCRIPT)(
+        keys=[rate_limit_key(user_id), quota_strikes_key(user_id)],
+        args=[Config.QUOTA_BACKOFF_SECONDS, Config.QUOTA_BACKOFF_MAX_SECONDS, random.random(), retry_after or 0]
+    )
+    return max(1, int(float(next_allowed) - float(now)) + 1)
+
+def backoff_seconds(attempt, base=None, cap=None):
+    """
+    Jittered exponential backoff before retry number `attempt` (1-based):
+    between half and all of min(cap, base * 2 ** (attempt - 1)).
+    """
+    base = base if base is not None else Config.SEND_RETRY_BASE_SECONDS
+    cap = cap if cap is not None else Config.SEND_RETRY_MAX_SECONDS
+    wait = min(cap, base * 2 ** (attempt - 1))
+    return wait / 2 + random.uniform(0, wait / 2)
@@ -0,0 +1,134 @@
+from datetime import datetime
+from sqlalchemy import select
+from config import Config
+from app import db
+from app.models import ContactedRecipient
+
+def normalize_email(email):
+    """
+    Key used for the contacted-recipient index: stripped and lowercased.
+    """
+    return (email or '').strip().lower()
+
+def _hash_emails(emails, normalized=False):
+    """
+    Stable 64-bit hashes of emails, computed in bulk.
+    """
+    import pandas as pd
+    
+    if not normalized:
+        emails = [normalize_email(email) for email in emails]
+    return pd.util.hash_pandas_object(pd.Series(emails, dtype=object), index=False).to_numpy()
+
+class ContactedIndex:
+    """
+    In-memory set of the recipients a user has already emailed, loaded once
+    per import. Emails are kept as a sorted array of 64-bit hashes (8 bytes
+    each), so hundreds of thousands of recipients cost a few MB, and a batch
+    of emails is checked with one vectorized binary search. A hash collision can
+    make a new address look contacted, with odds around 1 in 10^8 at a
+    million recipients.
+    """
+    
+    def __init__(self, hashes=None):
+        import numpy as np
+        
+        self.hashes = np.unique(hashes) if hashes is not None else np.empty(0, dtype=np.uint64)
+        self.skipped = 0
+    
+    @classmethod
+    def load(cls, user_id, chunk_size=None):
+        """
+        Load the user's contacted recipients, streaming rows in chunks.
+        """
+        import numpy as np
+        
+        chunk_size = chunk_size or Config.CONTACTED_LOAD_CHUNK_SIZE
+        # Plain Core rows on the session's connection: no ORM overhead per row
+        table = ContactedRecipient.__table__
+        result = db.session.connection().execute(
+            select(table.c.recipient_email).where(table.c.user_id == user_id),
+            execution_options={'stream_results': True}
+        )
+        # Stored emails are already normalized
+        chunks = [_hash_emails(emails, normalized=True) for emails in result.scalars().partitions(chunk_size)]
+        
+        return cls(np.concatenate(chunks) if chunks else None)
+    
+    def __len__(self):
+        return len(self.hashes)
+    
+    def contains_many(self, emails):
+        """
+        Boolean numpy array: True where the email was already contacted.
+        """
+        import numpy as np
+        
+        if not len(self.hashes) or not emails:
+            return np.zeros(len(emails), dtype=bool)
+        hashes = _hash_emails(emails)
+        # Binary search in the sorted hashes: O(batch * log(recipients))
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return self.hashes[positions] == hashes
+    
+    def filter_new(self, companies_data):
+        """
+        Drop already-contacted companies from a batch of parsed company
+        dicts, counting them in `skipped`.
+        """
+        contacted = self.contains_many([company['email'] for company in companies_data])
+        if not contacted.any():
+            return companies_data
+        self.skipped += int(contacted.sum())
+        return [company for company, seen in zip(companies_data, contacted) if not seen]
+
+def record_contacted(user_id, email, campaign_id=None):
+    """
+    Add a recipient to the user's contacted index, ignoring ones already in
+    it. Does not commit.
+    """
+    values = {
+        'user_id': user_id,
+        'recipient_email': normalize_email(email),
+        'campaign_id': campaign_id,
+        'first_contacted_at': datetime.utcnow(),
+    }
+    db.session.execute(_insert_ignore().values(**values))
+
+def backfill_contacted(user_id=None):
+    """
+    Fill the contacted index from emails already sent, e.g. after upgrading.
+    Returns the number of recipients added. Does not commit.
+    """
+    from sqlalchemy import func
+    from app.models import EmailLog, Company
+    
+    query = select(
+        EmailLog.user_id,
+        func.lower(func.trim(Company.recipient_email)),
+        func.min(EmailLog.campaign_id),
+        func.min(EmailLog.sent_at),
+    ).join(Company, Company.id == EmailLog.company_id).where(EmailLog.status == 'sent')
+    if user_id is not None:
+        query = query.where(EmailLog.user_id == user_id)
+    query = query.group_by(EmailLog.user_id, func.lower(func.trim(Company.recipient_email)))
+    
+    statement = _insert_ignore().from_select(
+        ['user_id', 'recipient_email', 'campaign_id', 'first_contacted_at'], query
+    )
+    return db.session.execute(statement).rowcount
+
+def _insert_ignore():
+    """
+    INSERT into contacted_recipients that skips rows already in the index.
+    """
+    table = ContactedRecipient.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing(index_elements=['user_id', 'recipient_email'])
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing(index_elements=['user_id', 'recipient_email'])
+    from sqlalchemy import insert
+    return insert(table).prefix_with('IGNORE')
@@ -0,0 +1,131 @@
+import uuid
+from config import Config
+from app.utils.events import get_redis
+
+# Sending is organised per user rather than per campaign: each user with
+# active campaigns has a single "send chain" (one outstanding Celery task),
+# so a user with a huge campaign, or many campaigns, never holds more than one
+# slot in the queue and every user gets a turn as soon as their rate limit
+# allows. Within a user, campaigns sit in a ready queue (a Redis sorted set
+# scored by virtual finish time) and are served by weighted fair queuing;
+# with equal weights that is plain round-robin.
+
+# Add a campaign at the current minimum virtual time, so it neither jumps
+# ahead of nor falls behind the user's other campaigns
+ENQUEUE_SCRIPT = """
+local first = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+local start = 0
+if first[2] then
+    start = tonumber(first[2])
+end
+redis.call('ZADD', KEYS[1], 'NX', start, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+# Extend or release the user's chain lease only if the given chain still
+# holds it: a run delayed past its lease must not take over a chain started
+# since then
+EXTEND_CHAIN_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_CHAIN_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def ready_queue_key(user_id):
+    return f'sendqueue:{user_id}'
+
+def weights_key(user_id):
+    return f'sendweights:{user_id}'
+
+def chain_key(user_id):
+    return f'sendchain:{user_id}'
+
+def shard_for_user(user_id):
+    return user_id % Config.SEND_SHARDS
+
+def send_queue_for_user(user_id):
+    """
+    Celery queue of the user's shard, or None for the default queue when
+    sending isn't sharded. Run one worker per shard with -Q sends.<n>.
+    """
+    if Config.SEND_SHARDS <= 1:
+        return None
+    return f'{Config.SEND_QUEUE_PREFIX}.{shard_for_user(user_id)}'
+
+def enqueue_campaign(user_id, campaign_id, weight=1):
+    """
+    Add a campaign to the user's ready queue. A higher weight gets
+    proportionally more of the user's sends.
+    """
+    get_redis().eval(
+        ENQUEUE_SCRIPT, 2, ready_queue_key(user_id), weights_key(user_id),
+        campaign_id, weight
+    )
+
+def remove_campaign(user_id, campaign_id):
+    pipe = get_redis().pipeline()
+    pipe.zrem(ready_queue_key(user_id), campaign_id)
+    pipe.hdel(weights_key(user_id), campaign_id)
+    pipe.execute()
+
+def ready_campaigns(user_id):
+    """
+    The user's queued campaign IDs, next to be served first.
+    """
+    return [int(campaign_id) for campaign_id in get_redis().zrange(ready_queue_key(user_id), 0, -1)]
+
+def charge_campaign(user_id, campaign_id):
+    """
+    Account one sent email to a campaign by advancing its virtual time by
+    1 / weight. Campaigns removed in the meantime are not re-added.
+    """
+    redis_client = get_redis()
+    weight = float(redis_client.hget(weights_key(user_id), campaign_id) or 1)
+    redis_client.zadd(ready_queue_key(user_id), {campaign_id: 1 / weight}, xx=True, incr=True)
+
+def claim_chain(user_id, ttl):
+    """
+    Become the user's send chain. Returns the chain's token, which its runs
+    carry along, or None if a chain is already running.
+    """
+    token = uuid.uuid4().hex
+    if get_redis().set(chain_key(user_id), token, nx=True, ex=ttl):
+        return token
+    return None
+
+def owns_chain(user_id, token):
+    """
+    True if `token` is the user's running send chain.
+    """
+    owner = get_redis().get(chain_key(user_id))
+    return owner is not None and owner.decode() == token
+
+def extend_chain(user_id, token, ttl):
+    """
+    Renew the chain lease for `ttl` seconds. Returns False if the chain has
+    lost it (the lease expired and another chain took over).
+    """
+    return bool(get_redis().eval(EXTEND_CHAIN_SCRIPT, 1, chain_key(user_id), token, ttl))
+
+def release_chain(user_id, token):
+    get_redis().eval(RELEASE_CHAIN_SCRIPT, 1, chain_key(user_id), token)
+
+def users_without_chain(user_ids):
+    """
+    The given users that have no send chain running, in one round trip.
+    """
+    user_ids = list(user_ids)
+    pipe = get_redis().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.exists(chain_key(user_id))
+    return [user_id for user_id, exists in zip(user_ids, pipe.execute()) if not exists]
@@ -0,0 +1,77 @@
+from sqlalchemy import func, cast, Integer
+from app import db
+from app.models import EmailLog, EmailLogSummary
+
+# Statuses shown on the dashboard and campaign pages
+STATUSES = ('sent', 'pending', 'failed')
+
+def _empty_stats():
+    stats = {status: 0 for status in STATUSES}
+    stats['total'] = 0
+    return stats
+
+# Claimed but not yet sent emails still count as pending
+STATUS_ALIASES = {'sending': 'pending'}
+
+def _add_count(stats, status, count):
+    status = STATUS_ALIASES.get(status, status)
+    if status in stats:
+        stats[status] += count
+    stats['total'] += count
+
+def _grouped_counts(group_by, **filters):
+    """
+    Email counts grouped by the `group_by` column names, over the live email
+    logs and the summaries of archived campaigns, in one query. Yields
+    (*group values, count) rows; a group can appear once from each source.
+    """
+    live_columns = [getattr(EmailLog, name) for name in group_by]
+    live = db.session.query(*live_columns, func.count(EmailLog.id)).filter_by(**filters).group_by(*live_columns)
+    
+    summary_columns = [getattr(EmailLogSummary, name) for name in group_by]
+    archived = db.session.query(
+        *summary_columns, cast(func.sum(EmailLogSummary.count), Integer)
+    ).filter_by(**filters).group_by(*summary_columns)
+    
+    return live.union_all(archived)
+
+def user_email_stats(user_id):
+    """
+    Email counts by status for all of a user's campaigns, in one query.
+    Returns {'sent', 'pending', 'failed', 'total'}.
+    """
+    stats = _empty_stats()
+    for status, count in _grouped_counts(('status',), user_id=user_id):
+        _add_count(stats, status, count)
+    return stats
+
+def campaign_email_stats(campaign_id):
+    """
+    Email counts by status for one campaign, in one query.
+    Returns {'sent', 'pending', 'failed', 'total'}.
+    """
+    stats = _empty_stats()
+    for status, count in _grouped_counts(('status',), campaign_id=campaign_id):
+        _add_count(stats, status, count)
+    return stats
+
+def campaigns_email_stats(user_id):
+    """
+    Email counts by status for every campaign of a user, in one query.
+    Returns {campaign_id: {'sent', 'pending', 'failed', 'total'}}; campaigns
+    without email logs are missing from the result.
+    """
+    stats = {}
+    for campaign_id, status, count in _grouped_counts(('campaign_id', 'status'), user_id=user_id):
+        _add_count(stats.setdefault(campaign_id, _empty_stats()), status, count)
+    return stats
+
+def sum_email_stats(stats_list):
+    """
+    Add up several stats dicts, e.g. per-campaign stats into user totals.
+    """
+    total = _empty_stats()
+    for stats in stats_list:
+        for key in total:
+            total[key] += stats[key]
+    return total
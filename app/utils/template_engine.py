@@ -0,0 +1,125 @@
+import re
+from functools import lru_cache
+
+# Placeholders every template can use, with their fallback values
+DEFAULT_FIELDS = {
+    'company_name': '',
+    'recipient_name': 'Hiring Manager',
+    'role': '',
+    'designation': '',
+}
+
+PLACEHOLDER_RE = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+SUBJECT_PREFIX = 'Subject:'
+
+class TemplateError(ValueError):
+    pass
+
+class _RowValues(dict):
+    """
+    Mapping handed to str.format_map: falls back to the template defaults and
+    renders anything else that is missing as an empty string.
+    """
+    def __init__(self, row, defaults):
+        super().__init__(row)
+        self.defaults = defaults
+    
+    def __missing__(self, key):
+        return self.defaults.get(key, '')
+
+def _split_segments(text):
+    """
+    Split text into alternating literal segments and placeholder names.
+    """
+    segments = []
+    position = 0
+    for match in PLACEHOLDER_RE.finditer(text):
+        segments.append(('text', text[position:match.start()]))
+        segments.append(('field', match.group(1)))
+        position = match.end()
+    segments.append(('text', text[position:]))
+    return segments
+
+def _format_string(segments):
+    """
+    Turn segments into a str.format pattern so rendering is one C-level pass.
+    """
+    parts = []
+    for kind, value in segments:
+        if kind == 'field':
+            parts.append('{' + value + '}')
+        else:
+            parts.append(value.replace('{', '{{').replace('}', '}}'))
+    return ''.join(parts)
+
+class EmailTemplate:
+    """
+    An email template compiled once into subject and body segments with
+    placeholder slots. Use compile_template() to get a cached instance.
+    """
+    
+    def __init__(self, template, extra_fields=(), strict=True):
+        self.source = template
+        
+        # Lines starting with "Subject:" set the subject (the last one wins),
+        # everything else is the body
+        subject_line = ''
+        body_lines = []
+        for line in template.split('\n'):
+            if line.startswith(SUBJECT_PREFIX):
+                subject_line = line.replace(SUBJECT_PREFIX, '')
+            else:
+                body_lines.append(line)
+        
+        self.subject_segments = _split_segments(subject_line)
+        self.body_segments = _split_segments('\n'.join(body_lines))
+        self.fields = [
+            value for kind, value in self.subject_segments + self.body_segments
+            if kind == 'field'
+        ]
+        
+        if strict:
+            allowed = set(DEFAULT_FIELDS) | set(extra_fields)
+            unknown = sorted(set(self.fields) - allowed)
+            if unknown:
+                raise TemplateError(
+                    'Unknown placeholder(s) in template: '
+                    + ', '.join('{' + name + '}' for name in unknown)
+                )
+        
+        self._subject_format = _format_string(self.subject_segments)
+        self._body_format = _format_string(self.body_segments)
+    
+    def render(self, row):
+        """
+        Render (subject, body) for one recipient's data.
+        """
+        values = _RowValues(row, DEFAULT_FIELDS)
+        return (
+            self._subject_format.format_map(values).strip(),
+            self._body_format.format_map(values).strip(),
+        )
+    
+    def render_many(self, rows):
+        """
+        Render (subject, body) for every row, in order.
+        """
+        subject_format = self._subject_format.format_map
+        body_format = self._body_format.format_map
+        results = []
+        for row in rows:
+            values = _RowValues(row, DEFAULT_FIELDS)
+            results.append((subject_format(values).strip(), body_format(values).strip()))
+        return results
+
+@lru_cache(maxsize=256)
+def _compile_cached(template, extra_fields, strict):
+    return EmailTemplate(template, extra_fields, strict)
+
+def compile_template(template, extra_fields=(), strict=True):
+    """
+    Compile a template, reusing the compiled version while the text is unchanged.
+    With strict=True, placeholders that are neither built in nor listed in
+    extra_fields raise TemplateError; otherwise they render as empty strings.
+    """
+    return _compile_cached(template, tuple(sorted(extra_fields)), strict)
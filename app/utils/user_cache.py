@@ -0,0 +1,76 @@
+import json
+import redis
+from datetime import datetime
+from flask_login import UserMixin
+from config import Config
+from app.utils.events import get_redis
+
+def user_cache_key(user_id):
+    return f'user:{user_id}:snapshot'
+
+class UserSnapshot(UserMixin):
+    """
+    Lightweight stand-in for User as current_user: the fields requests need,
+    without a database row behind it.
+    """
+    
+    def __init__(self, id, email, created_at=None):
+        self.id = id
+        self.email = email
+        self.created_at = created_at
+    
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.email, user.created_at)
+    
+    def to_json(self):
+        return json.dumps({
+            'id': self.id,
+            'email': self.email,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        })
+    
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        created_at = datetime.fromisoformat(data['created_at']) if data['created_at'] else None
+        return cls(data['id'], data['email'], created_at)
+    
+    def __repr__(self):
+        return f'<UserSnapshot {self.email}>'
+
+def get_user_snapshot(user_id):
+    """
+    Snapshot of a user from Redis, loaded from the database and cached for
+    USER_CACHE_TTL seconds on a miss. None if there is no such user. Falls
+    back to the database when Redis is unavailable.
+    """
+    from app import db
+    from app.models import User
+    
+    key = user_cache_key(user_id)
+    try:
+        raw = get_redis().get(key)
+    except redis.RedisError:
+        raw = None
+    if raw:
+        return UserSnapshot.from_json(raw)
+    
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    snapshot = UserSnapshot.from_user(user)
+    try:
+        get_redis().set(key, snapshot.to_json(), ex=Config.USER_CACHE_TTL)
+    except redis.RedisError:
+        pass
+    return snapshot
+
+def invalidate_user(user_id):
+    """
+    Drop a user's cached snapshot, e.g. after their email or password changed.
+    """
+    try:
+        get_redis().delete(user_cache_key(user_id))
+    except redis.RedisError:
+        pass
@@ -0,0 +1,190 @@
+"""
+Send scheduler simulation
+Discrete-event simulation of 1,000 users on a small worker pool, with a
+virtual clock and the same limits as the Redis rate limiter (hourly cap plus
+a random gap between emails). Compares:
+
+  per-campaign  one self-rescheduling task per campaign (the old design)
+  per-user      one send chain per user, campaigns served round-robin
+                from the user's ready queue (send_user_emails)
+
+and reports worker runs wasted on rate-limit rejections and queueing delay,
+i.e. how late a run starts after it became due.
+
+The per-user strategy goes through app.utils.scheduler itself (chain lease,
+ENQUEUE_SCRIPT, ready_campaigns, charge_campaign) against an in-process
+fakeredis. The rate limiter reads the Redis server clock, so its limits are
+modelled on the virtual clock instead.
+
+Usage: python benchmarks/bench_fair_scheduler.py [users] [workers] [hours]
+"""
+
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAX_PER_HOUR = 4
+MIN_DELAY = 60
+MAX_DELAY = 300
+SEND_SECONDS = 1.0        # worker time for one send
+REJECT_SECONDS = 0.05     # worker time for a run that is rate limited
+
+class UserLimiter:
+    def __init__(self):
+        self.hour_start = 0.0
+        self.hour_count = 0
+        self.next_allowed = 0.0
+    
+    def acquire(self, now, delay):
+        if now - self.hour_start >= 3600:
+            self.hour_start = now
+            self.hour_count = 0
+        if self.hour_count >= MAX_PER_HOUR:
+            return False, self.hour_start + 3600
+        if now < self.next_allowed:
+            return False, self.next_allowed
+        self.hour_count += 1
+        self.next_allowed = now + delay
+        return True, self.next_allowed
+
+def make_users(count, rng):
+    """
+    10% heavy users with 5 large campaigns, the rest with one small campaign.
+    Returns {user_id: [pending emails per campaign]}.
+    """
+    users = {}
+    for user_id in range(count):
+        if user_id % 10 == 0:
+            users[user_id] = [2000] * 5
+        else:
+            users[user_id] = [rng.randint(20, 100)]
+    return users
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def use_fakeredis():
+    """
+    Point the scheduler at a fresh fakeredis, so the simulation never
+    touches a real server's queues.
+    """
+    import fakeredis
+    from app.utils import events
+    
+    events._redis = fakeredis.FakeRedis()
+
+def next_campaign(user_id, campaigns):
+    """
+    The campaign a run of the user's send chain serves: the first in the
+    ready queue with pending emails, dropping finished ones as
+    active_campaign does.
+    """
+    from app.utils.scheduler import ready_campaigns, remove_campaign
+    
+    for index in ready_campaigns(user_id):
+        if campaigns[index]:
+            return index
+        remove_campaign(user_id, index)
+    return None
+
+def simulate(strategy, user_count, workers, hours, seed=1):
+    from app.utils.scheduler import enqueue_campaign, charge_campaign, claim_chain, extend_chain, release_chain
+    
+    use_fakeredis()
+    rng = random.Random(seed)
+    users = make_users(user_count, rng)
+    limiters = {user_id: UserLimiter() for user_id in users}
+    horizon = hours * 3600
+    
+    # Ready tasks ordered by due time: (due, seq, user_id, campaign index or
+    # chain token)
+    tasks = []
+    seq = 0
+    for user_id, campaigns in users.items():
+        start = rng.uniform(0, 60)
+        if strategy == 'per-user':
+            for index in range(len(campaigns)):
+                enqueue_campaign(user_id, index)
+            tasks.append((start, seq, user_id, claim_chain(user_id, horizon)))
+            seq += 1
+        else:
+            for index in range(len(campaigns)):
+                tasks.append((start, seq, user_id, index))
+                seq += 1
+    heapq.heapify(tasks)
+    
+    worker_free = [0.0] * workers
+    delays = {'heavy': [], 'light': []}
+    sent = wasted = 0
+    
+    while tasks:
+        due, _, user_id, index = heapq.heappop(tasks)
+        worker = worker_free.index(min(worker_free))
+        start = max(due, worker_free[worker])
+        if start > horizon:
+            break
+        
+        campaigns = users[user_id]
+        token = None
+        if strategy == 'per-user':
+            # Per-user chain: next campaign from the ready queue
+            token = index
+            index = next_campaign(user_id, campaigns)
+            if index is None:
+                release_chain(user_id, token)
+                continue
+        elif not campaigns[index]:
+            continue
+        
+        delays['heavy' if user_id % 10 == 0 else 'light'].append(start - due)
+        allowed, retry_at = limiters[user_id].acquire(start, rng.randint(MIN_DELAY, MAX_DELAY))
+        if allowed:
+            campaigns[index] -= 1
+            if token:
+                charge_campaign(user_id, index)
+            sent += 1
+            worker_free[worker] = start + SEND_SECONDS
+        else:
+            wasted += 1
+            worker_free[worker] = start + REJECT_SECONDS
+        
+        if token:
+            extend_chain(user_id, token, horizon)
+            index = token
+        heapq.heappush(tasks, (max(retry_at, worker_free[worker]), seq, user_id, index))
+        seq += 1
+    
+    all_delays = delays['heavy'] + delays['light']
+    return {
+        'strategy': strategy,
+        'sent': sent,
+        'wasted_runs': wasted,
+        'delay_p50': percentile(all_delays, 0.50),
+        'delay_p99': percentile(all_delays, 0.99),
+        'delay_max': max(all_delays) if all_delays else 0.0,
+        'light_user_delay_p99': percentile(delays['light'], 0.99),
+    }
+
+def run(user_count=1000, workers=2, hours=4):
+    print(f"{user_count} users, {workers} workers, {hours}h simulated")
+    print(f"{'strategy':<13} {'sent':>7} {'wasted':>7} {'p50 s':>7} {'p99 s':>7} {'max s':>7} {'light p99':>10}")
+    results = []
+    for strategy in ('per-campaign', 'per-user'):
+        result = simulate(strategy, user_count, workers, hours)
+        results.append(result)
+        print(
+            f"{strategy:<13} {result['sent']:>7} {result['wasted_runs']:>7} "
+            f"{result['delay_p50']:>7.1f} {result['delay_p99']:>7.1f} {result['delay_max']:>7.1f} "
+            f"{result['light_user_delay_p99']:>10.1f}"
+        )
+    return results
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    run(*args)
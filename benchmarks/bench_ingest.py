@@ -0,0 +1,71 @@
+"""
+Campaign ingestion benchmark
+Inserts N synthetic companies (default 100k) with their pending email logs
+through ingest_companies and reports rows/second and peak Python memory.
+
+Usage: python benchmarks/bench_ingest.py [rows] [database_url]
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def synthetic_companies(rows):
+    for i in range(rows):
+        yield {
+            'company_name': f'Company {i}',
+            'email': f'hr{i}@company{i % 500}.com',
+            'name': f'Recruiter {i}',
+            'role': 'Software Engineer',
+            'designation': 'HR Manager',
+            'extra': {},
+        }
+
+def run(rows, database_url):
+    os.environ['DATABASE_URL'] = database_url
+    
+    from app import create_app, db
+    from app.models import User, Campaign, EmailLog
+    from app.utils.ingest import ingest_companies
+    
+    app = create_app()
+    
+    with app.app_context():
+        user = User(email=f'bench{os.getpid()}@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        
+        def ingest_campaign():
+            campaign = Campaign(user_id=user.id, name='bench', email_template='Subject: Hi\nHello')
+            db.session.add(campaign)
+            db.session.flush()
+            result = ingest_companies(campaign.id, user.id, synthetic_companies(rows))
+            db.session.commit()
+            assert EmailLog.query.filter_by(campaign_id=campaign.id).count() == rows
+            return result
+        
+        # Time without tracemalloc (it slows allocation-heavy code down a lot),
+        # then measure peak memory on a second run
+        result = ingest_campaign()
+        tracemalloc.start()
+        ingest_campaign()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    
+    print(f"Rows inserted:   {result['inserted']}")
+    print(f"Time:            {result['seconds']:.2f}s")
+    print(f"Rows/second:     {result['rows_per_second']:.0f}")
+    print(f"Peak memory:     {peak / (1024 * 1024):.1f} MB")
+    return result, peak
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    if len(sys.argv) > 2:
+        database_url = sys.argv[2]
+    else:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    run(rows, database_url)
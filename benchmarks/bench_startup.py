@@ -0,0 +1,104 @@
+"""
+Startup benchmark
+Times a cold import of the web entry point (run.py) and the worker entry
+point (celery_worker.py) in fresh interpreters, lists the slowest imports
+from `python -X importtime`, and compares building an app per task
+(create_app) with the worker's shared app (get_app).
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENTRY_POINTS = ('run', 'celery_worker')
+HEAVY_MODULES = ('pandas', 'openpyxl', 'googleapiclient', 'google_auth_oauthlib')
+TASK_RUNS = 50
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+def cold_import(module, env):
+    """
+    Import `module` in a fresh interpreter, return (seconds, heavy modules loaded).
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout.split('\n')
+    return float(output[0]), [m for m in output[1].split(',') if m]
+
+def slowest_imports(module, env, top=5):
+    """
+    Return the `top` modules imported directly by `module`'s import tree
+    with the largest cumulative import time.
+    """
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Each nesting level adds two spaces; keep the first level below the entry point
+        if name.startswith('   ') and not name.startswith('     '):
+            packages[name.strip()] = int(cumulative) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+def task_setup(env):
+    """
+    Seconds per task spent getting an app: a new one each run vs the shared one.
+    """
+    os.environ.update(env)
+    from app import create_app
+    from app.tasks import get_app
+    
+    start = time.perf_counter()
+    for _ in range(TASK_RUNS):
+        with create_app().app_context():
+            pass
+    per_run = (time.perf_counter() - start) / TASK_RUNS
+    
+    get_app()
+    start = time.perf_counter()
+    for _ in range(TASK_RUNS):
+        with get_app().app_context():
+            pass
+    shared = (time.perf_counter() - start) / TASK_RUNS
+    return per_run, shared
+
+def run(runs=5):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}')
+    
+    for module in ENTRY_POINTS:
+        timings = []
+        for _ in range(runs):
+            seconds, heavy = cold_import(module, env)
+            timings.append(seconds)
+        print(f"import {module}: median {statistics.median(timings) * 1000:.0f} ms over {runs} runs, "
+              f"heavy modules loaded: {', '.join(heavy) or 'none'}")
+        for name, seconds in slowest_imports(module, env):
+            print(f"    {name:<24} {seconds * 1000:>7.1f} ms")
+    
+    per_run, shared = task_setup(env)
+    print(f"app per task: create_app {per_run * 1000:.2f} ms, shared app {shared * 1000:.3f} ms")
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
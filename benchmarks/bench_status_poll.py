@@ -0,0 +1,122 @@
+"""
+Campaign status polling benchmark
+Compares the grouped-count stats query used by campaign_status_api with
+the old approach of loading every EmailLog row and counting in Python,
+for campaigns of 1k, 10k and 100k email logs, and times a poll of the
+status API that revalidates with If-None-Match.
+
+The grouped query still scans the campaign's (campaign_id, status) index
+entries, so its cost grows with the number of logs. A client polling with
+its ETag gets a 304 from one Redis read while nothing has changed, which
+costs the same at any campaign size; only polls that follow a change pay
+for the query.
+
+Usage: python benchmarks/bench_status_poll.py [database_url]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_ingest import synthetic_companies
+
+SIZES = (1_000, 10_000, 100_000)
+POLLS = 20
+
+def legacy_stats(campaign_id):
+    from app.models import EmailLog
+    
+    email_logs = EmailLog.query.filter_by(campaign_id=campaign_id).all()
+    return {
+        'total': len(email_logs),
+        'sent': len([log for log in email_logs if log.status == 'sent']),
+        'pending': len([log for log in email_logs if log.status == 'pending']),
+        'failed': len([log for log in email_logs if log.status == 'failed']),
+    }
+
+def time_polls(func, campaign_id, polls):
+    from app import db
+    
+    started = time.perf_counter()
+    for _ in range(polls):
+        func(campaign_id)
+        db.session.remove()
+    return (time.perf_counter() - started) / polls
+
+def time_revalidations(client, campaign_id, polls):
+    """
+    Average time of a status API poll carrying the ETag of the previous
+    response, while the campaign doesn't change.
+    """
+    url = f'/api/campaign/{campaign_id}/status'
+    etag = client.get(url).headers['ETag']
+    started = time.perf_counter()
+    for _ in range(polls):
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    return (time.perf_counter() - started) / polls
+
+def run(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    
+    import fakeredis
+    from app import create_app, db
+    from app.models import User, Campaign, EmailLog
+    from app.utils import events
+    from app.utils.ingest import ingest_companies
+    from app.utils.stats import campaign_email_stats
+    
+    events._redis = fakeredis.FakeRedis()
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    results = []
+    
+    email = f'poll{os.getpid()}@example.com'
+    with app.app_context():
+        user = User(email=email)
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    # Outside the app context below, whose g would keep the logged in User row
+    client.post('/auth/login', data={'email': email, 'password': 'bench'})
+    
+    with app.app_context():
+        print(f"{'logs':>8}  {'grouped query':>14}  {'load all rows':>14}  {'304 poll':>11}")
+        for size in SIZES:
+            campaign = Campaign(user_id=user_id, name=f'poll {size}', email_template='Subject: Hi\nHello')
+            db.session.add(campaign)
+            db.session.flush()
+            campaign_id = campaign.id
+            ingest_companies(campaign_id, user_id, synthetic_companies(size))
+            # Mark a third of the logs as sent so there is more than one group
+            EmailLog.query.filter(
+                EmailLog.campaign_id == campaign_id,
+                EmailLog.id % 3 == 0
+            ).update({'status': 'sent'}, synchronize_session=False)
+            db.session.commit()
+            
+            assert campaign_email_stats(campaign_id)['total'] == size
+            grouped = time_polls(campaign_email_stats, campaign_id, POLLS)
+            legacy = time_polls(legacy_stats, campaign_id, max(1, POLLS // 10))
+            revalidated = time_revalidations(client, campaign_id, POLLS)
+            results.append({
+                'logs': size,
+                'grouped_ms': grouped * 1000,
+                'legacy_ms': legacy * 1000,
+                'not_modified_ms': revalidated * 1000,
+            })
+            print(f"{size:>8}  {grouped * 1000:>11.2f} ms  {legacy * 1000:>11.2f} ms  {revalidated * 1000:>8.2f} ms")
+    
+    return results
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        database_url = sys.argv[1]
+    else:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    run(database_url)
@@ -0,0 +1,338 @@
+"""
+End-to-end benchmark suite
+Generates synthetic companies files (CSV and XLSX, 1k/10k/100k rows by
+default) and measures each stage of a campaign:
+
+  parse    parse_companies_file
+  ingest   the ingest_campaign_file task behind new_campaign
+  render   prepare_email_content for every company
+  mime     build_message with a resume attachment
+  send     the send task loop, on the fake mail transport (campaigns of
+           up to --max-send-rows emails)
+
+Sends run on a virtual clock: re-enqueued tasks are run in ETA order right
+away instead of waiting out their countdowns, with the rate limits lifted so
+the Redis limiter never holds them back. The send stage uses REDIS_URL, or
+an in-process fakeredis if no server answers and fakeredis is installed.
+
+Throughput and peak Python memory of every stage go to a JSON results file
+(benchmarks/results/<commit>.json by default) to compare across commits.
+
+Usage: python benchmarks/suite.py [--sizes 1000,10000] [--formats csv,xlsx]
+           [--database-url URL] [--output FILE] [--no-memory] [--max-send-rows N]
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SIZES = (1_000, 10_000, 100_000)
+FORMATS = ('csv', 'xlsx')
+HEADER = ['Company Name', 'Email', 'Recipient Name', 'Role', 'Designation', 'Team Lead']
+TEMPLATE = (
+    'Subject: Application for {role} at {company_name}\n'
+    'Dear {recipient_name},\n\n'
+    'I am writing to apply for the {role} position at {company_name}. '
+    'I would love to join {team_lead}\'s team.\n\n'
+    'Best regards'
+)
+RESUME_BYTES = 200 * 1024
+# Each send is a few queries and commits, so larger campaigns take minutes
+MAX_SEND_ROWS = 10_000
+
+def synthetic_rows(rows):
+    for i in range(rows):
+        yield [
+            f'Company {i}',
+            f'hr{i}@company{i % 500}.com',
+            f'Recruiter {i}',
+            'Software Engineer',
+            'HR Manager',
+            f'Lead {i % 50}',
+        ]
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(synthetic_rows(rows))
+
+def write_xlsx(path, rows):
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in synthetic_rows(rows):
+        sheet.append(row)
+    workbook.save(path)
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
+
+def measure(fn, memory=True):
+    """
+    Run fn() untraced for timing, then again under tracemalloc for peak
+    memory (tracing slows allocation-heavy code down too much to time it).
+    Returns (items processed, seconds, peak bytes or None).
+    """
+    started = time.perf_counter()
+    items = fn()
+    seconds = time.perf_counter() - started
+    
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return items, seconds, peak
+
+class VirtualClock:
+    """
+    Stand-in for the broker: apply_async() calls are queued by ETA on a
+    virtual clock and run in order without sleeping.
+    """
+    
+    def __init__(self):
+        self.now = 0.0
+        self.queue = []
+        self.seq = 0
+        self.runs = 0
+    
+    def apply_async(self, task):
+        def enqueue(args=(), kwargs=None, countdown=None, eta=None, queue=None, **options):
+            self.seq += 1
+            heapq.heappush(self.queue, (self.now + (countdown or 0), self.seq, task, args, kwargs or {}))
+        return enqueue
+    
+    def run(self):
+        while self.queue:
+            self.now, _, task, args, kwargs = heapq.heappop(self.queue)
+            self.runs += 1
+            task.run(*args, **kwargs)
+
+def use_redis():
+    """
+    Point the app at REDIS_URL, or at fakeredis when no server answers.
+    Returns a description of the Redis used, or None if neither is available.
+    """
+    import redis
+    from config import Config
+    from app.utils import events
+    
+    try:
+        events.get_redis().ping()
+        return Config.REDIS_URL
+    except redis.RedisError:
+        pass
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    events._redis = fakeredis.FakeRedis()
+    return 'fakeredis'
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(sizes=SIZES, formats=FORMATS, database_url=None, output=None, memory=True, max_send_rows=MAX_SEND_ROWS):
+    workdir = tempfile.mkdtemp(prefix='applyflow-bench-')
+    database_url = database_url or 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ.update(
+        DATABASE_URL=database_url,
+        EMAIL_VALIDATION_MODE='syntax',
+        MAIL_TRANSPORT='fake',
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+    )
+    
+    from config import Config
+    from app import db
+    from app.models import User, Campaign, Company, EmailLog
+    from app.utils.file_parser import parse_companies_file
+    from app.utils.email_sender import build_message, prepare_email_content
+    from app.utils.mail_transport import get_transport
+    from app.utils.events import publish_campaign_event
+    import app.tasks as tasks
+    
+    # Lift the rate limits: the virtual clock can't move the limiter's clock
+    Config.MAX_EMAILS_PER_HOUR = Config.MAX_EMAILS_PER_DAY = 10 ** 9
+    Config.MIN_DELAY_SECONDS = Config.MAX_DELAY_SECONDS = 0
+    
+    app = tasks.get_app()
+    # The parser imports pandas lazily; don't bill that to the first parse
+    import pandas
+    
+    redis_used = use_redis()
+    if redis_used is None:
+        print('No Redis server or fakeredis available, skipping the send stage')
+    
+    resume_path = os.path.join(workdir, 'resume.pdf')
+    with open(resume_path, 'wb') as f:
+        f.write(os.urandom(RESUME_BYTES))
+    
+    results = []
+    
+    def record(stage, size, file_format, items, seconds, peak):
+        result = {
+            'stage': stage,
+            'rows': size,
+            'format': file_format,
+            'items': items,
+            'seconds': round(seconds, 4),
+            'items_per_second': round(items / seconds, 1) if seconds else None,
+            'peak_memory_bytes': peak,
+        }
+        results.append(result)
+        peak_text = f'{peak / (1024 * 1024):8.1f} MB' if peak is not None else ''
+        print(f'{stage:<7} {file_format:<5} {size:>8} rows  {seconds:8.2f}s  '
+              f'{result["items_per_second"] or 0:>10.0f}/s  {peak_text}')
+    
+    with app.app_context():
+        user = User(email=f'bench{os.getpid()}@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        
+        def new_campaign(status):
+            campaign = Campaign(
+                user_id=user.id, name='bench', email_template=TEMPLATE,
+                resume_path=resume_path, status=status, schedule_type='manual'
+            )
+            db.session.add(campaign)
+            db.session.commit()
+            return campaign
+        
+        # Bench campaigns stay 'importing' after the import; the send stage
+        # starts them itself
+        tasks.finish_campaign_import.delay = lambda *args: None
+        
+        for size in sizes:
+            campaigns = []
+            for file_format in formats:
+                path = os.path.join(workdir, f'companies_{size}.{file_format}')
+                WRITERS[file_format](path, size)
+                
+                # Parse
+                record('parse', size, file_format, *measure(lambda: len(parse_companies_file(path)), memory))
+                
+                # Ingest through the background import task
+                def ingest():
+                    campaign = new_campaign('importing')
+                    copy = os.path.join(workdir, f'upload_{campaign.id}.{file_format}')
+                    shutil.copyfile(path, copy)
+                    tasks.ingest_campaign_file.run(campaign.id, copy)
+                    campaigns.append(campaign.id)
+                    # The task committed through its own session
+                    db.session.expire_all()
+                    return db.session.get(Campaign, campaign.id).rows_inserted
+                
+                record('ingest', size, file_format, *measure(ingest, memory))
+            
+            # Rendering, MIME building and sending don't depend on the file format
+            campaign_id = campaigns[0]
+            company_data = [
+                {
+                    **(company.extra_fields or {}),
+                    'company_name': company.company_name,
+                    'recipient_name': company.recipient_name or 'Hiring Manager',
+                    'role': company.role or '',
+                    'designation': company.designation or '',
+                }
+                for company in Company.query.filter_by(campaign_id=campaign_id).order_by(Company.id)
+            ]
+            
+            def render():
+                return len([prepare_email_content(TEMPLATE, data) for data in company_data])
+            
+            record('render', size, '-', *measure(render, memory))
+            
+            rendered = [prepare_email_content(TEMPLATE, data) for data in company_data]
+            
+            def mime():
+                for (subject, body), data in zip(rendered, company_data):
+                    build_message(f'{data["company_name"]}@example.com', subject, body, resume_path)
+                return len(rendered)
+            
+            record('mime', size, '-', *measure(mime, memory))
+            
+            if redis_used is None or size > max_send_rows:
+                continue
+            
+            # Send every email of an ingested campaign (the traced run takes
+            # the next one)
+            fake_transport = get_transport('fake')
+            campaign_ids = iter(campaigns)
+            clock = VirtualClock()
+            tasks.send_user_emails.apply_async = clock.apply_async(tasks.send_user_emails)
+            tasks.resume_campaign.apply_async = clock.apply_async(tasks.resume_campaign)
+            
+            def send():
+                cid = next(campaign_ids)
+                # As the start route does
+                Campaign.query.filter_by(id=cid).update({'status': 'active'})
+                db.session.commit()
+                publish_campaign_event(cid, 'active')
+                sent_before = fake_transport.sent
+                tasks.start_email_campaign.run(cid)
+                clock.run()
+                sent = fake_transport.sent - sent_before
+                assert EmailLog.query.filter_by(campaign_id=cid, status='sent').count() == sent
+                return sent
+            
+            record('send', size, '-', *measure(send, memory))
+    
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': database_url.split(':', 1)[0],
+        'redis': redis_used,
+        'results': results,
+    }
+    output = output or os.path.join(ROOT, 'benchmarks', 'results', f'{report["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+    
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ApplyFlow end-to-end benchmarks')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES))
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--database-url')
+    parser.add_argument('--output')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced runs for peak memory')
+    parser.add_argument('--max-send-rows', type=int, default=MAX_SEND_ROWS,
+                        help='skip the send stage for larger sizes')
+    args = parser.parse_args()
+    
+    run(
+        sizes=[int(size) for size in args.sizes.split(',')],
+        formats=args.formats.split(','),
+        database_url=args.database_url,
+        output=args.output,
+        memory=not args.no_memory,
+        max_send_rows=args.max_send_rows,
+    )
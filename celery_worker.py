@@ -1,5 +1,4 @@
-from app.tasks import celery
-from app import create_app
+from app.tasks import celery, get_app
 
-app = create_app()
+app = get_app()
 app.app_context().push()
@@ -6,27 +6,123 @@ load_dotenv()
 class Config:
     # Flask
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+    # Logged-in users are loaded from a snapshot cached in Redis for this long
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))
     
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'postgresql://localhost/applyflow')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Run create_all when an app is created; turn off once tables exist and use `flask init-db`
+    AUTO_CREATE_TABLES = os.getenv('AUTO_CREATE_TABLES', 'true').lower() == 'true'
     
     # Redis & Celery
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     CELERY_BROKER_URL = REDIS_URL
     CELERY_RESULT_BACKEND = REDIS_URL
+    # Sends are re-enqueued with countdowns of up to an hour and resumes with
+    # an ETA of the next morning, so keep Redis from redelivering them early
+    BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 2 * 24 * 3600}
+    # Per-user send chains can be sharded over queues sends.0 .. sends.<N-1>
+    SEND_SHARDS = int(os.getenv('SEND_SHARDS', 1))
+    SEND_QUEUE_PREFIX = os.getenv('SEND_QUEUE_PREFIX', 'sends')
+    SEND_CHAIN_LEASE_SECONDS = int(os.getenv('SEND_CHAIN_LEASE_SECONDS', 600))  # on top of each countdown
+    # A failed send run re-enqueues the chain after this long; beat revives
+    # chains lost altogether every SEND_SWEEP_INTERVAL_SECONDS
+    SEND_ERROR_RETRY_SECONDS = int(os.getenv('SEND_ERROR_RETRY_SECONDS', 60))
+    SEND_SWEEP_INTERVAL_SECONDS = int(os.getenv('SEND_SWEEP_INTERVAL_SECONDS', 300))
+    # Email logs left in 'sending' longer than this (crashed worker) are claimed again
+    SEND_CLAIM_LEASE_SECONDS = int(os.getenv('SEND_CLAIM_LEASE_SECONDS', 300))
+    # Campaign statuses are mirrored in Redis for the send tasks; re-read from
+    # the database when the mirror expires
+    CAMPAIGN_STATUS_TTL = int(os.getenv('CAMPAIGN_STATUS_TTL', 3600))
+    # Scheduled campaigns are started by the dispatch task, run by celery beat
+    DISPATCH_INTERVAL_SECONDS = int(os.getenv('DISPATCH_INTERVAL_SECONDS', 30))
+    DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', 500))  # campaigns claimed per transaction
+    # Email logs of campaigns completed this long ago are rolled up into
+    # daily summaries and moved to the archive table by celery beat
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+    ROLLUP_INTERVAL_SECONDS = int(os.getenv('ROLLUP_INTERVAL_SECONDS', 3600))
+    ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', 20))  # campaigns per run
+    CELERYBEAT_SCHEDULE = {
+        'dispatch-scheduled-campaigns': {
+            'task': 'app.tasks.dispatch_scheduled_campaigns',
+            'schedule': DISPATCH_INTERVAL_SECONDS,
+        },
+        'revive-send-chains': {
+            'task': 'app.tasks.revive_send_chains',
+            'schedule': SEND_SWEEP_INTERVAL_SECONDS,
+        },
+        'rollup-email-logs': {
+            'task': 'app.tasks.rollup_email_logs',
+            'schedule': ROLLUP_INTERVAL_SECONDS,
+        },
+    }
+    SSE_KEEPALIVE_SECONDS = int(os.getenv('SSE_KEEPALIVE_SECONDS', 15))
     
     # Gmail API
     GMAIL_CREDENTIALS_FILE = os.getenv('GMAIL_CREDENTIALS_FILE', 'credentials.json')
     GMAIL_TOKEN_FILE = os.getenv('GMAIL_TOKEN_FILE', 'token.json')
     
+    # Mail transport: 'gmail', 'smtp' or 'fake'
+    MAIL_TRANSPORT = os.getenv('MAIL_TRANSPORT', 'gmail')
+    MAIL_FROM = os.getenv('MAIL_FROM', '')
+    # Sent messages the fake transport keeps in memory (it counts all of them)
+    FAKE_OUTBOX_SIZE = int(os.getenv('FAKE_OUTBOX_SIZE', 0))
+    
+    # SMTP (used when MAIL_TRANSPORT=smtp)
+    SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+    SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+    SMTP_USERNAME = os.getenv('SMTP_USERNAME', '')
+    SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
+    SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+    
+    # Encoded resume attachments kept in memory per worker process
+    ATTACHMENT_CACHE_BYTES = int(os.getenv('ATTACHMENT_CACHE_BYTES', 64 * 1024 * 1024))  # 64MB
+    
     # Rate Limiting
     MAX_EMAILS_PER_HOUR = int(os.getenv('MAX_EMAILS_PER_HOUR', 4))
     MAX_EMAILS_PER_DAY = int(os.getenv('MAX_EMAILS_PER_DAY', 25))
     MIN_DELAY_SECONDS = int(os.getenv('MIN_DELAY_SECONDS', 60))
     MAX_DELAY_SECONDS = int(os.getenv('MAX_DELAY_SECONDS', 300))
     
+    # Retries: transient send errors retry the email with exponential backoff,
+    # quota errors back off all of the user's sending
+    SEND_MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', 5))
+    SEND_RETRY_BASE_SECONDS = int(os.getenv('SEND_RETRY_BASE_SECONDS', 60))
+    SEND_RETRY_MAX_SECONDS = int(os.getenv('SEND_RETRY_MAX_SECONDS', 3600))
+    QUOTA_BACKOFF_SECONDS = int(os.getenv('QUOTA_BACKOFF_SECONDS', 300))
+    QUOTA_BACKOFF_MAX_SECONDS = int(os.getenv('QUOTA_BACKOFF_MAX_SECONDS', 6 * 3600))
+    
     # Upload
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB
     ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls', 'pdf', 'docx'}
+    
+    # Companies file import
+    PARSE_CHUNK_SIZE = int(os.getenv('PARSE_CHUNK_SIZE', 5000))  # rows read per chunk
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))  # rows per bulk insert
+    IMPORT_REPORT_MAX_REJECTED = int(os.getenv('IMPORT_REPORT_MAX_REJECTED', 100))  # rejected rows kept for the report
+    # Skip recipients the user already emailed in an earlier campaign
+    SKIP_CONTACTED_RECIPIENTS = os.getenv('SKIP_CONTACTED_RECIPIENTS', 'true').lower() == 'true'
+    CONTACTED_LOAD_CHUNK_SIZE = int(os.getenv('CONTACTED_LOAD_CHUNK_SIZE', 10000))
+    
+    # Email validation: 'dns' checks each distinct domain's MX records, 'syntax' stays offline
+    EMAIL_VALIDATION_MODE = os.getenv('EMAIL_VALIDATION_MODE', 'dns')
+    EMAIL_DOMAIN_CACHE_TTL = int(os.getenv('EMAIL_DOMAIN_CACHE_TTL', 24 * 3600))  # seconds
+    EMAIL_DNS_WORKERS = int(os.getenv('EMAIL_DNS_WORKERS', 16))
+    
+    # Metrics: per-stage timings served on /metrics (web) and by a per-process
+    # exporter on METRICS_WORKER_PORT and up (workers)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_WORKER_PORT = int(os.getenv('METRICS_WORKER_PORT', 9200))
+    METRICS_WORKER_PORT_RANGE = int(os.getenv('METRICS_WORKER_PORT_RANGE', 16))
+    METRICS_CAMPAIGN_TTL = int(os.getenv('METRICS_CAMPAIGN_TTL', 30 * 24 * 3600))  # per-campaign breakdowns
+    
+    # Campaign results export: rows fetched per batch, and where XLSX exports
+    # built by the background task are kept
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+    EXPORT_FOLDER = os.getenv('EXPORT_FOLDER', 'exports')
+    
+    # Campaign email log pagination
+    LOGS_PAGE_SIZE = int(os.getenv('LOGS_PAGE_SIZE', 50))
+    LOGS_MAX_PAGE_SIZE = int(os.getenv('LOGS_MAX_PAGE_SIZE', 500))
@@ -0,0 +1,70 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from config import Config
+from app import create_app, db
+from app.models import User, Campaign, Company, EmailLog
+from app.utils import events
+from app.utils.scheduler import chain_key
+import app.tasks as tasks
+
+class TestConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    AUTO_CREATE_TABLES = True
+    MAIL_TRANSPORT = 'fake'
+
+@pytest.fixture
+def queued(monkeypatch):
+    """
+    Runs of send_user_emails queued with apply_async, as (user_id, token).
+    """
+    monkeypatch.setattr(events, '_redis', fakeredis.FakeRedis())
+    app = create_app(TestConfig)
+    monkeypatch.setattr(tasks, '_app', app)
+    runs = []
+    monkeypatch.setattr(tasks.send_user_emails, 'apply_async', lambda args, countdown=None, queue=None: runs.append(args))
+    with app.app_context():
+        user = User(email='user@example.com')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        campaign = Campaign(user_id=user.id, name='c', email_template='Subject: Hi\nHello', status='active')
+        db.session.add(campaign)
+        db.session.commit()
+        for i in range(5):
+            company = Company(campaign_id=campaign.id, company_name=f'C{i}', recipient_email=f'r{i}@example.com')
+            db.session.add(company)
+            db.session.flush()
+            db.session.add(EmailLog(campaign_id=campaign.id, company_id=company.id, user_id=user.id))
+        db.session.commit()
+        events.publish_campaign_event(campaign.id, 'active')
+        yield runs, user.id, campaign.id
+        db.drop_all()
+
+def test_late_run_does_not_fork_chain_after_sweep(queued):
+    runs, user_id, campaign_id = queued
+    tasks.start_email_campaign.run(campaign_id)
+    assert len(runs) == 1
+    late_run = runs.pop()
+    
+    # The queued run is held up past its lease, and the sweep starts a new chain
+    events.get_redis().delete(chain_key(user_id))
+    tasks.revive_send_chains.run()
+    assert len(runs) == 1
+    revived_token = runs[0][1]
+    assert revived_token != late_run[1]
+    
+    # The late run finds another chain holding the lease and stops
+    tasks.send_user_emails.run(*late_run)
+    assert len(runs) == 1
+    
+    # Only the revived chain keeps rescheduling itself
+    for _ in range(10):
+        run = runs.pop(0)
+        tasks.send_user_emails.run(*run)
+        assert len(runs) <= 1
+        if not runs:
+            break
+        assert runs[0][1] == revived_token
+    assert events.get_redis().get(chain_key(user_id)) in (None, revived_token.encode())